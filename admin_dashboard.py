@@ -1,15 +1,23 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
-from database import Database, User, Message, ChatSession
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for
+from database import get_database, User, Message, ChatSession
 from surveillance import SurveillanceSystem
 from config import Config
 import datetime
+import math
+import metrics
+import profiler
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this in production
 
-# Initialize database and surveillance
-db = Database(Config.DATABASE_URL)
-surveillance = SurveillanceSystem(db)
+# The database is opened by the first request that needs it, not at import
+surveillance = SurveillanceSystem()
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    db = get_database(create=False)
+    if db is not None:
+        db.remove_session()
 
 def require_admin_login(f):
     def decorated_function(*args, **kwargs):
@@ -52,8 +60,8 @@ def admin_login():
 @require_admin_login
 def dashboard():
     stats = surveillance.get_system_stats()
-    users = db.get_all_users()
-    recent_messages = db.get_all_chats()[:50]  # Last 50 messages
+    users = get_database().get_all_users()
+    recent_messages = get_database().get_all_chats()[:50]  # Last 50 messages
     
     return f'''
     <html>
@@ -93,7 +101,7 @@ def dashboard():
             
             <div class="user-list">
                 <h2>👥 All Users ({len(users)})</h2>
-                {' '.join([f'''
+                {' '.join([f"""
                 <div class="user-item">
                     <strong>User ID:</strong> {user.user_id} | 
                     <strong>Name:</strong> {user.first_name or 'N/A'} {user.last_name or ''} | 
@@ -102,19 +110,19 @@ def dashboard():
                     <strong>Joined:</strong> {user.join_date.strftime('%Y-%m-%d %H:%M')} |
                     <a href="/admin/user/{user.user_id}">View Details</a>
                 </div>
-                ''' for user in users])}
+                """ for user in users])}
             </div>
             
             <div class="chat-list">
                 <h2>💬 Recent Messages</h2>
-                {' '.join([f'''
+                {' '.join([f"""
                 <div class="message-item">
                     <strong>From:</strong> {msg.from_user_id} | 
                     <strong>To:</strong> {msg.to_user_id} | 
                     <strong>Time:</strong> {msg.timestamp.strftime('%H:%M:%S')} | 
                     <strong>Message:</strong> {msg.message_text[:100]}{'...' if len(msg.message_text) > 100 else ''}
                 </div>
-                ''' for msg in recent_messages])}
+                """ for msg in recent_messages])}
             </div>
         </body>
     </html>
@@ -123,11 +131,11 @@ def dashboard():
 @app.route('/admin/user/<int:user_id>')
 @require_admin_login
 def user_detail(user_id):
-    user = db.session.query(User).filter_by(user_id=user_id).first()
+    user = get_database().session.query(User).filter_by(user_id=user_id).first()
     if not user:
         return "User not found"
     
-    messages = db.get_user_messages(user_id)
+    messages = get_database().get_user_messages(user_id)
     analytics = surveillance.get_user_analytics(user_id)
     
     return f'''
@@ -146,30 +154,76 @@ def user_detail(user_id):
             <p><strong>Joined:</strong> {user.join_date.strftime('%Y-%m-%d %H:%M')}</p>
             <p><strong>Last Active:</strong> {user.last_active.strftime('%Y-%m-%d %H:%M')}</p>
             <p><strong>Status:</strong> {'🚫 BANNED' if user.is_banned else '✅ Active'}</p>
+            <form method="post" action="/admin/user/{user.user_id}/{'unban' if user.is_banned else 'ban'}">
+                <button type="submit">{'✅ Unban user' if user.is_banned else '🚫 Ban user'}</button>
+            </form>
             
             <h2>Message History ({len(messages)} messages)</h2>
-            {' '.join([f'''
+            {' '.join([f"""
             <div style="border:1px solid #ccc; padding:10px; margin:5px;">
                 <strong>{'Sent' if msg.from_user_id == user_id else 'Received'}</strong> | 
                 <strong>Time:</strong> {msg.timestamp.strftime('%Y-%m-%d %H:%M')} | 
                 <strong>To/From:</strong> {msg.to_user_id if msg.from_user_id == user_id else msg.from_user_id}<br>
                 {msg.message_text}
             </div>
-            ''' for msg in messages])}
+            """ for msg in messages])}
         </body>
     </html>
     '''
 
+@app.route('/admin/user/<int:user_id>/ban', methods=['POST'])
+@require_admin_login
+def ban_user(user_id):
+    # Also updates the bot's in-memory banned set when both run in this process
+    get_database().set_user_banned(user_id, True)
+    surveillance.log_admin_action(session['admin_username'], f'Banned user {user_id}')
+    return redirect(url_for('user_detail', user_id=user_id))
+
+@app.route('/admin/user/<int:user_id>/unban', methods=['POST'])
+@require_admin_login
+def unban_user(user_id):
+    get_database().set_user_banned(user_id, False)
+    surveillance.log_admin_action(session['admin_username'], f'Unbanned user {user_id}')
+    return redirect(url_for('user_detail', user_id=user_id))
+
 @app.route('/admin/api/stats')
 @require_admin_login
 def api_stats():
     return jsonify(surveillance.get_system_stats())
 
+@app.route('/admin/api/profile', methods=['GET', 'POST'])
+@require_admin_login
+def api_profile():
+    # POST starts a profile of the bot's event loop on its own thread, GET returns the last report.
+    # Dashboard requests share one thread, so this one must not wait for the profile.
+    if profiler.loop_thread_id is None:
+        return jsonify({'error': 'The bot is not running in this process'}), 503
+    if request.method == 'GET':
+        return jsonify({'running': profiler.is_running(), 'report': profiler.last_report})
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        seconds = None
+    if seconds is None or not math.isfinite(seconds):
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if not profiler.start_profile(seconds):
+        return jsonify({'error': 'A profile is already running'}), 409
+    surveillance.log_admin_action(session['admin_username'], 'Profiled the bot event loop')
+    return jsonify({'running': True, 'seconds': min(seconds, Config.PROFILE_MAX_SECONDS)}), 202
+
+@app.route('/admin/api/metrics')
+def api_metrics():
+    # Scrapers authenticate with the bearer token, admins with their dashboard login
+    token_ok = Config.METRICS_TOKEN and request.headers.get('Authorization') == f'Bearer {Config.METRICS_TOKEN}'
+    if not token_ok and 'admin_logged_in' not in session:
+        return Response('Unauthorized', status=401, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/admin/api/messages')
 @require_admin_login
 def api_messages():
     limit = request.args.get('limit', 100)
-    messages = db.get_all_chats()[:int(limit)]
+    messages = get_database().get_all_chats()[:int(limit)]
     return jsonify([{
         'id': msg.id,
         'from_user_id': msg.from_user_id,
@@ -0,0 +1,155 @@
+"""Single-process runtime: Telegram updates and the admin dashboard on one event loop.
+
+Run with `uvicorn asgi:app` (or `python asgi.py`). Telegram POSTs updates
+to Config.WEBHOOK_PATH, which are handed straight to the Application's
+update queue; every other request is served by the Flask admin app.
+With UPDATE_MODE=polling the same process long-polls instead.
+
+Webhook mode never accepts unauthenticated updates: without WEBHOOK_SECRET
+a secret is derived from BOT_TOKEN, so every worker of `uvicorn --workers N`
+agrees on it, and registered along with WEBHOOK_URL. With neither set
+startup fails. Recorded updates can be replayed locally, e.g.
+    curl -X POST localhost:8000/telegram/webhook \
+        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" -d @update.json
+"""
+import hashlib
+import hmac
+import json
+import logging
+from asgiref.wsgi import WsgiToAsgi
+from telegram import Update
+from admin_dashboard import app as flask_app
+from bot import build_application
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def derive_webhook_secret(token):
+    """A webhook secret every process computes alike from the bot token, without exposing the token"""
+    return hmac.new(token.encode(), b'webhook-secret', hashlib.sha256).hexdigest()
+
+class BotASGIApp:
+    def __init__(self, admin_app=None, update_mode=None):
+        self.admin = WsgiToAsgi(admin_app or flask_app)
+        self.update_mode = update_mode or Config.UPDATE_MODE
+        self.application = None
+        self.webhook_secret = Config.WEBHOOK_SECRET
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == Config.WEBHOOK_PATH:
+            await self.handle_webhook(scope, receive, send)
+        else:
+            await self.admin(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.exception("Bot startup failed")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        if not Config.BOT_TOKEN:
+            print("❌ BOT_TOKEN not set! Serving the dashboard only")
+            return
+
+        webhook = self.update_mode == 'webhook'
+        if webhook and not self.webhook_secret:
+            if not Config.WEBHOOK_URL:
+                raise RuntimeError("Webhook mode needs WEBHOOK_SECRET, or WEBHOOK_URL to register a generated one")
+            # Only Telegram learns this secret, through set_webhook below
+            self.webhook_secret = derive_webhook_secret(Config.BOT_TOKEN)
+        self.application = build_application(webhook=webhook)
+        await self.application.initialize()
+        # run_polling would call post_init for us, here the lifespan drives the Application
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await self.application.start()
+        if not webhook:
+            await self.application.updater.start_polling()
+            print("✅ Bot started - polling for updates")
+        elif Config.WEBHOOK_URL:
+            await self.application.bot.set_webhook(
+                url=Config.WEBHOOK_URL,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES
+            )
+            print(f"✅ Bot started - webhook registered at {Config.WEBHOOK_URL}")
+        else:
+            print(f"✅ Bot started - accepting updates on {Config.WEBHOOK_PATH}")
+
+    async def shutdown(self):
+        if self.application is None:
+            return
+        if self.application.updater and self.application.updater.running:
+            await self.application.updater.stop()
+        await self.application.stop()
+        # Pending sends go out before shutdown() closes the Bot's HTTP client
+        if self.application.post_stop:
+            await self.application.post_stop(self.application)
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+
+    async def handle_webhook(self, scope, receive, send):
+        if self.application is None:
+            await self.respond(send, 503, b'Service Unavailable')
+            return
+        if scope['method'] != 'POST':
+            await self.respond(send, 405, b'Method Not Allowed')
+            return
+
+        headers = dict(scope['headers'])
+        token = headers.get(b'x-telegram-bot-api-secret-token', b'')
+        if not self.webhook_secret or not hmac.compare_digest(token, self.webhook_secret.encode()):
+            await self.respond(send, 403, b'Forbidden')
+            return
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError("update is not a JSON object")
+            update = Update.de_json(data, self.application.bot)
+            if update is None:
+                raise ValueError("empty update")
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            await self.respond(send, 400, b'Bad Request')
+            return
+
+        # Acknowledge right away, the Application processes the queue on this same loop
+        await self.application.update_queue.put(update)
+        await self.respond(send, 200, b'OK')
+
+    async def respond(self, send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+app = BotASGIApp()
+
+if __name__ == '__main__':
+    import os
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 8000)))
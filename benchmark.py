@@ -0,0 +1,174 @@
+"""Micro-benchmarks for the bot's in-memory data structures.
+
+Run with `python benchmark.py`. Each benchmark prints the cost per
+operation at growing pool sizes, so a structure whose cost stays flat
+as the pool grows is easy to tell apart from one that degrades.
+"""
+import os
+import random
+import tempfile
+import time
+from matchmaking import MatchmakingQueue, RecentPartners
+from state import SQLiteStateBackend
+
+POOL_SIZES = (1_000, 10_000, 100_000)
+GENDERS = ('male', 'female', 'any')
+
+class LegacyWaitingLists:
+    """The original list-based waiting pool, kept here for comparison"""
+    def __init__(self):
+        self.waiting_users = {gender: [] for gender in GENDERS}
+
+    def add(self, user_id, gender):
+        if user_id not in self.waiting_users[gender]:
+            self.waiting_users[gender].append(user_id)
+
+    def pop_partner(self, user_id, gender, is_available=None):
+        potential_partners = []
+        if gender == 'male':
+            potential_partners.extend(self.waiting_users['female'])
+        elif gender == 'female':
+            potential_partners.extend(self.waiting_users['male'])
+        potential_partners.extend(self.waiting_users['any'])
+
+        for partner_id in potential_partners:
+            if partner_id != user_id:
+                for gender_list in self.waiting_users.values():
+                    if user_id in gender_list:
+                        gender_list.remove(user_id)
+                    if partner_id in gender_list:
+                        gender_list.remove(partner_id)
+                return partner_id
+        return None
+
+def fill_pool(pool, size):
+    # Only one side of the market waits so the pool does not pair itself off
+    for user_id in range(size):
+        pool.add(user_id, 'male')
+
+def bench_search_and_pair(pool_factory, size, rounds=2_000):
+    """Average seconds for one search that pairs with a waiting user"""
+    pool = pool_factory()
+    fill_pool(pool, size)
+
+    next_id = size
+    start = time.perf_counter()
+    for _ in range(rounds):
+        # A searcher arrives, pairs, and a new waiter refills the pool
+        searcher = next_id
+        pool.add(searcher, 'female')
+        pool.pop_partner(searcher, 'female')
+        pool.add(next_id + 1, 'male')
+        next_id += 2
+    return (time.perf_counter() - start) / rounds
+
+def report(title, pool_factory, sizes, rounds):
+    print(f"\n{title}")
+    print(f"{'waiting':>10} | {'us/search+pair':>15}")
+    for size in sizes:
+        cost = bench_search_and_pair(pool_factory, size, rounds=rounds)
+        print(f"{size:>10} | {cost * 1e6:>15.2f}")
+
+def run_matchmaking_benchmark():
+    report("MatchmakingQueue", MatchmakingQueue, POOL_SIZES, rounds=20_000)
+    # The legacy lists are O(n) per search, so give them fewer rounds
+    report("Legacy waiting lists", LegacyWaitingLists, POOL_SIZES, rounds=200)
+
+INTEREST_TAGS = [f'tag{index}' for index in range(500)]
+
+def random_interests(rng):
+    # A quarter of the users set no interests, the rest pick a few of a skewed vocabulary
+    if rng.random() < 0.25:
+        return []
+    return list({INTEREST_TAGS[int(rng.paretovariate(1.2)) % len(INTEREST_TAGS)] for _ in range(rng.randint(1, 5))})
+
+def bench_interest_search(pool, size, rounds, rng):
+    """Average seconds for one interest search against size waiters, and the share that found a shared tag"""
+    for user_id in range(size):
+        pool.enqueue(user_id, 'male', random_interests(rng))
+
+    next_id = size
+    shared = 0
+    start = time.perf_counter()
+    for index in range(rounds):
+        searcher = next_id
+        interests = random_interests(rng) or ['tag0']
+        pool.enqueue(searcher, 'female', interests)
+        partner_id = pool.pair(searcher, 'female', f'session-{index}')
+        if partner_id is not None:
+            shared += bool(pool.interests[partner_id] & set(interests))
+        pool.enqueue(next_id + 1, 'male', random_interests(rng))
+        next_id += 2
+    return (time.perf_counter() - start) / rounds, shared / rounds
+
+class QueuePool:
+    """MatchmakingQueue behind the enqueue/pair interface the state backends expose"""
+    def __init__(self):
+        self.queue = MatchmakingQueue()
+        self.interests = {}
+
+    def enqueue(self, user_id, gender, interests):
+        self.interests[user_id] = set(interests)
+        self.queue.add(user_id, gender, interests)
+
+    def pair(self, user_id, gender, session_id):
+        return self.queue.pop_partner(user_id, gender)
+
+class SQLitePool(QueuePool):
+    def __init__(self, path):
+        self.backend = SQLiteStateBackend(path)
+        self.interests = {}
+
+    def enqueue(self, user_id, gender, interests):
+        self.interests[user_id] = set(interests)
+        self.backend.enqueue(user_id, gender, interests)
+
+    def pair(self, user_id, gender, session_id):
+        return self.backend.pair(user_id, gender, session_id)
+
+def run_interest_benchmark():
+    print("\nInterest matching (searches that pair with a waiter sharing a tag)")
+    print(f"{'waiting':>10} | {'backend':>8} | {'us/search+pair':>15} | {'shared tag':>10}")
+    for size in POOL_SIZES:
+        cost, shared = bench_interest_search(QueuePool(), size, 5_000, random.Random(size))
+        print(f"{size:>10} | {'memory':>8} | {cost * 1e6:>15.2f} | {shared:>10.0%}")
+        with tempfile.TemporaryDirectory() as directory:
+            pool = SQLitePool(os.path.join(directory, 'state.db'))
+            cost, shared = bench_interest_search(pool, size, 500, random.Random(size))
+            pool.backend.close()
+        print(f"{size:>10} | {'sqlite':>8} | {cost * 1e6:>15.2f} | {shared:>10.0%}")
+
+HISTORY_SIZES = (1, 5, 20, 100)
+
+def bench_recent_search(history_size, pool_size, rounds, rng):
+    """Average seconds for one search+pair when every waiter remembers history_size recent partners, and the pairs held"""
+    recent = RecentPartners(size=history_size, max_users=pool_size + 2 * rounds)
+    pool = MatchmakingQueue()
+    for user_id in range(pool_size):
+        pool.add(user_id, 'male')
+        for _ in range(history_size):
+            recent.record(user_id, rng.randrange(pool_size, 2 * pool_size))
+
+    next_id = 2 * pool_size
+    start = time.perf_counter()
+    for _ in range(rounds):
+        searcher = next_id
+        pool.add(searcher, 'female')
+        partner_id = pool.pop_partner(searcher, 'female', avoid=lambda candidate: recent.avoids(searcher, candidate))
+        if partner_id is not None:
+            recent.record(searcher, partner_id)
+        pool.add(next_id + 1, 'male')
+        next_id += 2
+    return (time.perf_counter() - start) / rounds, len(recent.pairs)
+
+def run_recent_partner_benchmark():
+    print("\nRecent-partner avoidance (10,000 waiting)")
+    print(f"{'history':>10} | {'us/search+pair':>15} | {'remembered pairs':>16}")
+    for history_size in HISTORY_SIZES:
+        cost, pairs = bench_recent_search(history_size, 10_000, 20_000, random.Random(history_size))
+        print(f"{history_size:>10} | {cost * 1e6:>15.2f} | {pairs:>16}")
+
+if __name__ == '__main__':
+    run_matchmaking_benchmark()
+    run_interest_benchmark()
+    run_recent_partner_benchmark()
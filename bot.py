@@ -1,44 +1,78 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
+import asyncio
 import logging
+import time
 import uuid
-import datetime
-from database import Database, User, ChatSession, Message
+from concurrency import KeyedLocks, UserOrderedUpdateProcessor
+from database import close_database, get_database
+from expiry import ExpiryTracker
+from flood import FloodControl
+from matchmaking import RecentPartners, normalize_interests
+from metrics import instrument_handler
+import metrics
+from outbound import OutboundScheduler
+import profiler
+from snapshot import load_snapshot, save_snapshot
+from state import create_state_backend
 from config import Config
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize database
-db = Database(Config.DATABASE_URL)
+# Message attributes in the order they are checked, animations also carry a document
+MESSAGE_KINDS = (
+    'text', 'animation', 'photo', 'video', 'video_note', 'voice', 'audio', 'document',
+    'sticker', 'venue', 'location', 'contact', 'poll', 'dice'
+)
+
+def message_kind(message):
+    """The message_type recorded for a relayed message, e.g. 'photo' or 'sticker'"""
+    for kind in MESSAGE_KINDS:
+        if getattr(message, kind, None):
+            return kind
+    return 'other'
+
+BANNED_TEXT = "🚫 You have been banned from this bot."
 
 class AnonymousChatBot:
-    def __init__(self):
-        self.active_sessions = {}  # user_id -> session_data
+    def __init__(self, state=None, outbound=None, db=None, flood=None):
+        self.db = db or get_database()
+        self.flood = flood if flood is not None else FloodControl()
+        self.state = state or create_state_backend()  # waiting pool and active sessions
         self.user_states = {}  # user_id -> state
-        self.waiting_users = {
-            'male': [],
-            'female': [],
-            'any': []
-        }
+        self.outbound = outbound or OutboundScheduler()
+        self.pair_locks = KeyedLocks()  # session_id -> lock
+        self.session_activity = ExpiryTracker(Config.USER_SESSION_TIMEOUT)  # session_id -> (user_id, partner_id)
+        self.waiter_activity = ExpiryTracker(Config.WAITING_TIMEOUT)  # user_id of everyone searching
+        self.match_fallback = ExpiryTracker(Config.INTEREST_MATCH_WAIT)  # user_id -> gender, retried without interests
+        self.reaper = None
+        self.snapshotter = None
+        # Banned users are dropped from the pool when a search comes across them
+        self.state.exclude = self.db.is_banned
+        # Users who just chatted aren't paired again while anyone else is waiting
+        self.recent_partners = RecentPartners()
+        if self.recent_partners.enabled:
+            self.state.recent = self.recent_partners
     
     async def start(self, update: Update, context: CallbackContext):
         user = update.effective_user
         user_id = user.id
         
+        # Bans are checked in memory before any other work on the update
+        if self.db.is_banned(user_id):
+            await update.message.reply_text(BANNED_TEXT)
+            return
+        
         # Add user to database
-        existing_user = db.session.query(User).filter_by(user_id=user_id).first()
-        if not existing_user:
-            new_user = User(
-                user_id=user_id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name,
-                join_date=datetime.datetime.utcnow()
-            )
-            db.session.add(new_user)
-            db.session.commit()
+        await self.db.aio.get_or_create_user(
+            user_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
         
         keyboard = [
             [InlineKeyboardButton("🚀 Start Chatting", callback_data='start_chat')],
@@ -58,36 +92,77 @@ class AnonymousChatBot:
     
     async def handle_message(self, update: Update, context: CallbackContext):
         user_id = update.effective_user.id
-        message_text = update.message.text
+        message = update.message
         
-        # Log message for surveillance
-        if user_id in self.active_sessions:
-            session_data = self.active_sessions[user_id]
-            partner_id = session_data['partner_id']
-            
-            # Log the message
-            db.log_message(
-                session_id=session_data['session_id'],
-                from_user_id=user_id,
-                to_user_id=partner_id,
-                message_text=message_text
-            )
+        # Messages from banned users are dropped without a reply
+        if self.db.is_banned(user_id):
+            return
+        
+        # Over-limit messages are dropped before they cost a write or a send
+        allowed, notify = self.flood.check(user_id)
+        if not allowed:
+            if notify:
+                self.outbound.submit(context.bot, user_id, "⏳ Slow down! Some of your messages were not delivered.")
+            return
+        
+        session_data = await self.state.aio.get_session(user_id)
+        if not session_data:
+            await message.reply_text("❌ You're not in an active chat. Use /start to begin.")
+            return
+        
+        session_id = session_data['session_id']
+        partner_id = session_data['partner_id']
+        
+        if self.db.is_banned(partner_id):
+            await self.close_chat(user_id)
+            await message.reply_text("❌ Your partner has left the chat. Use /start to find a new partner.")
+            return
+        
+        # Relays and teardown of one pair never interleave
+        partner_lost = False
+        async with self.pair_locks.hold(session_id):
+            current = await self.state.aio.get_session(user_id)
+            if not current or current['session_id'] != session_id:
+                await message.reply_text("❌ You're not in an active chat. Use /start to begin.")
+                return
+            self.session_activity.touch(session_id, (user_id, partner_id))
             
-            # Forward message to partner
+            # Copy the message to the partner, Telegram reuses the original file so nothing is re-uploaded
             try:
-                await context.bot.send_message(
-                    chat_id=partner_id,
-                    text=f"🗣️: {message_text}"
-                )
-                await update.message.reply_text("✅ Message sent!")
+                await self.outbound.copy_message(context.bot, partner_id, user_id, message.message_id)
+            except BadRequest as e:
+                logger.warning(f"Could not relay {message_kind(message)} message from {user_id}: {e}")
+                await message.reply_text("❌ This kind of message can't be relayed.")
             except Exception as e:
-                await update.message.reply_text("❌ Partner disconnected. Starting new search...")
-                await self.start_search(update, context, user_id)
-        else:
-            await update.message.reply_text("❌ You're not in an active chat. Use /start to begin.")
+                logger.warning(f"Could not relay message from {user_id} to {partner_id}: {e}")
+                partner_lost = True
+            else:
+                # Only delivered messages are logged and counted
+                await self.db.aio.log_message(
+                    session_id=session_id,
+                    from_user_id=user_id,
+                    to_user_id=partner_id,
+                    message_text=message.text or message.caption or '',
+                    message_type=message_kind(message)
+                )
+                await self.state.aio.count_message(user_id)
+                self.outbound.submit(context.bot, user_id, "✅ Message sent!")
+        
+        if partner_lost:
+            # End the old chat for both sides first, a search must never start from inside a session
+            await self.close_chat(user_id)
+            self.outbound.submit(
+                context.bot, partner_id,
+                "❌ Your partner has ended the chat. Use /start to find a new partner."
+            )
+            await message.reply_text("❌ Partner disconnected. Starting new search...")
+            await self.start_search(update, context, user_id)
     
     async def button_handler(self, update: Update, context: CallbackContext):
         query = update.callback_query
+        if self.db.is_banned(query.from_user.id):
+            await query.answer(BANNED_TEXT, show_alert=True)
+            return
         await query.answer()
         
         user_id = query.from_user.id
@@ -103,6 +178,7 @@ class AnonymousChatBot:
                 "• Use /start to begin\n"
                 "• Click 'Start Chatting' to find a partner\n"
                 "• Set your gender for better matching\n"
+                "• Type /interests music, travel to meet people who share them\n"
                 "• Type /stop to end current chat\n"
                 "• Be respectful to others!\n\n"
                 "Your chats are anonymous and secure."
@@ -111,17 +187,20 @@ class AnonymousChatBot:
     async def start_search(self, update: Update, context: CallbackContext, user_id=None):
         if not user_id:
             user_id = update.effective_user.id
+        if self.db.is_banned(user_id):
+            return
         
-        # Get user gender preference
-        user = db.session.query(User).filter_by(user_id=user_id).first()
-        gender = user.gender if user and user.gender else 'any'
+        # Get user gender preference and interests
+        profile = await self.db.aio.get_user_profile(user_id) or {}
+        gender = profile.get('gender') or 'any'
         
         # Add to waiting list
-        if user_id not in self.waiting_users[gender]:
-            self.waiting_users[gender].append(user_id)
+        await self.state.aio.enqueue(user_id, gender, profile.get('interests', ()))
+        self.waiter_activity.touch(user_id)
+        self.match_fallback.touch(user_id, gender)
         
         # Try to find match
-        await self.find_match(user_id, gender, context)
+        await self.find_match(user_id, gender, context.bot)
         
         if isinstance(update, Update) and update.callback_query:
             await update.callback_query.edit_message_text(
@@ -129,72 +208,44 @@ class AnonymousChatBot:
                 "Please wait while we find someone for you to talk with!"
             )
     
-    async def find_match(self, user_id, gender, context):
-        # Simple matching algorithm
-        potential_partners = []
-        
-        # Add opposite gender matches
-        if gender == 'male':
-            potential_partners.extend(self.waiting_users['female'])
-        elif gender == 'female':
-            potential_partners.extend(self.waiting_users['male'])
-        
-        # Add any gender matches
-        potential_partners.extend(self.waiting_users['any'])
-        
-        # Remove self and find available partner
-        for partner_id in potential_partners:
-            if partner_id != user_id and partner_id not in self.active_sessions:
-                # Create chat session
-                session_id = str(uuid.uuid4())
-                
-                self.active_sessions[user_id] = {
-                    'session_id': session_id,
-                    'partner_id': partner_id,
-                    'start_time': datetime.datetime.utcnow()
-                }
-                self.active_sessions[partner_id] = {
-                    'session_id': session_id,
-                    'partner_id': user_id,
-                    'start_time': datetime.datetime.utcnow()
-                }
-                
-                # Remove from waiting lists
-                for gender_list in self.waiting_users.values():
-                    if user_id in gender_list:
-                        gender_list.remove(user_id)
-                    if partner_id in gender_list:
-                        gender_list.remove(partner_id)
-                
-                # Create session in database
-                chat_session = ChatSession(
-                    session_id=session_id,
-                    user1_id=user_id,
-                    user2_id=partner_id
-                )
-                db.session.add(chat_session)
-                db.session.commit()
-                
-                # Notify both users
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text="✅ **Connected!** You're now chatting anonymously.\n\n"
-                             "Type your messages and they'll be sent to your partner.\n"
-                             "Use /stop to end the chat."
-                    )
-                    await context.bot.send_message(
-                        chat_id=partner_id,
-                        text="✅ **Connected!** You're now chatting anonymously.\n\n"
-                             "Type your messages and they'll be sent to your partner.\n"
-                             "Use /stop to end the chat."
-                    )
-                except Exception as e:
-                    logger.error(f"Error notifying users: {e}")
-                
-                return True
-        
-        return False
+    async def find_match(self, user_id, gender, bot):
+        # Atomically claim the best compatible partner and open the session
+        session_id = str(uuid.uuid4())
+        with metrics.span('matchmaking'):
+            partner_id = await self.state.aio.pair(user_id, gender, session_id)
+        if partner_id is None:
+            return False
+        self.recent_partners.record(user_id, partner_id)
+        for waiter in (user_id, partner_id):
+            self.waiter_activity.discard(waiter)
+            self.match_fallback.discard(waiter)
+        self.session_activity.touch(session_id, (user_id, partner_id))
+        
+        # Create session in database, a /stop racing in on this worker waits for the row to exist
+        async with self.pair_locks.hold(session_id):
+            row_id = await self.db.aio.create_chat_session(session_id, user_id, partner_id)
+            if not await self.state.aio.attach_row(user_id, row_id, session_id):
+                # Closed on another worker before the row existed, so nothing ended it there
+                self.session_activity.discard(session_id)
+                await self.db.aio.end_chat_session(session_id, row_id)
+                return False
+        
+        # Notify both users
+        connected_text = (
+            "✅ **Connected!** You're now chatting anonymously.\n\n"
+            "Type your messages and they'll be sent to your partner.\n"
+            "Use /stop to end the chat."
+        )
+        results = await asyncio.gather(
+            self.outbound.send_message(bot, user_id, connected_text),
+            self.outbound.send_message(bot, partner_id, connected_text),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error notifying users: {result}")
+        
+        return True
     
     async def set_gender(self, update: Update, context: CallbackContext):
         keyboard = [
@@ -217,16 +268,16 @@ class AnonymousChatBot:
     
     async def gender_handler(self, update: Update, context: CallbackContext):
         query = update.callback_query
+        if self.db.is_banned(query.from_user.id):
+            await query.answer(BANNED_TEXT, show_alert=True)
+            return
         await query.answer()
         
         user_id = query.from_user.id
         gender = query.data.replace('gender_', '')
         
         # Update user in database
-        user = db.session.query(User).filter_by(user_id=user_id).first()
-        if user:
-            user.gender = gender
-            db.session.commit()
+        await self.db.aio.set_user_gender(user_id, gender)
         
         gender_display = {
             'male': '👨 Male',
@@ -236,37 +287,229 @@ class AnonymousChatBot:
         
         await query.edit_message_text(f"✅ Gender set to: {gender_display[gender]}")
     
+    async def set_interests(self, update: Update, context: CallbackContext):
+        user_id = update.effective_user.id
+        if self.db.is_banned(user_id):
+            await update.message.reply_text(BANNED_TEXT)
+            return
+        
+        if not context.args:
+            profile = await self.db.aio.get_user_profile(user_id) or {}
+            current = ', '.join(profile.get('interests') or []) or 'none'
+            await update.message.reply_text(
+                f"🏷️ Your interests: {current}\n\n"
+                "Use /interests music, travel, games to set them or /interests clear to remove them. "
+                "Searches prefer partners who share them."
+            )
+            return
+        
+        interests = [] if context.args == ['clear'] else normalize_interests(' '.join(context.args))
+        await self.db.aio.set_user_interests(user_id, interests)
+        if interests:
+            await update.message.reply_text(f"✅ Interests set to: {', '.join(interests)}")
+        else:
+            await update.message.reply_text("✅ Interests cleared")
+    
     async def stop_chat(self, update: Update, context: CallbackContext):
         user_id = update.effective_user.id
+        session_data = await self.close_chat(user_id)
         
-        if user_id in self.active_sessions:
-            session_data = self.active_sessions[user_id]
+        if session_data:
             partner_id = session_data['partner_id']
             
-            # End session in database
-            chat_session = db.session.query(ChatSession).filter_by(
-                session_id=session_data['session_id']
-            ).first()
-            if chat_session:
-                chat_session.end_time = datetime.datetime.utcnow()
-                db.session.commit()
-            
-            # Remove from active sessions
-            self.active_sessions.pop(user_id, None)
-            self.active_sessions.pop(partner_id, None)
-            
-            # Notify partner
-            try:
-                await context.bot.send_message(
-                    chat_id=partner_id,
-                    text="❌ Your partner has ended the chat. Use /start to find a new partner."
-                )
-            except:
-                pass
-            
-            await update.message.reply_text("✅ Chat ended. Use /start to find a new partner.")
+            # Notify both sides without waiting on each other
+            self.outbound.submit(
+                context.bot, partner_id,
+                "❌ Your partner has ended the chat. Use /start to find a new partner."
+            )
+            await self.outbound.send_message(context.bot, user_id, "✅ Chat ended. Use /start to find a new partner.")
         else:
             await update.message.reply_text("❌ You're not in an active chat.")
+    
+    async def close_chat(self, user_id):
+        """End user_id's chat for both sides, in memory and in the database, return its data or None"""
+        # Remove from active sessions once relays already in flight on this pair are done
+        session_data = await self.state.aio.get_session(user_id)
+        if session_data:
+            async with self.pair_locks.hold(session_data['session_id']):
+                session_data = await self.state.aio.close_session(user_id)
+        
+        if session_data:
+            self.session_activity.discard(session_data['session_id'])
+            await self.db.aio.end_chat_session(
+                session_data['session_id'], session_data['row_id'], session_data['message_count']
+            )
+        return session_data
+    
+    async def retry_waiters(self, bot):
+        """Search again for users who have waited INTEREST_MATCH_WAIT, now taking any partner"""
+        matched = 0
+        for user_id, gender in self.match_fallback.expired():
+            if await self.state.aio.is_waiting(user_id) and await self.find_match(user_id, gender, bot):
+                matched += 1
+        return matched
+    
+    async def reap_idle(self, bot):
+        """End chats idle past USER_SESSION_TIMEOUT and drop searches older than WAITING_TIMEOUT"""
+        for user_id, _ in self.waiter_activity.expired():
+            if await self.state.aio.is_waiting(user_id):
+                await self.state.aio.dequeue(user_id)
+                self.outbound.submit(bot, user_id, "⌛ No partner found in time. Use /start to search again.")
+        
+        reaped = 0
+        while True:
+            batch = self.session_activity.expired(Config.REAPER_BATCH_SIZE)
+            closed = []
+            for session_id, (user_id, partner_id) in batch:
+                async with self.pair_locks.hold(session_id):
+                    current = await self.state.aio.get_session(user_id)
+                    if not current or current['session_id'] != session_id:
+                        continue
+                    # A shared backend knows about messages relayed by other workers
+                    idle = time.time() - current.get('last_active', 0)
+                    if idle < self.session_activity.timeout:
+                        self.session_activity.touch(session_id, (user_id, partner_id), idle)
+                        continue
+                    closed.append((await self.state.aio.close_session(user_id), user_id, partner_id))
+            
+            if closed:
+                # One transaction for the whole batch
+                await self.db.aio.end_chat_sessions([session_data for session_data, _, _ in closed])
+                for _, user_id, partner_id in closed:
+                    for chat_id in (user_id, partner_id):
+                        self.outbound.submit(bot, chat_id, "⌛ Chat ended after inactivity. Use /start to find a new partner.")
+                reaped += len(closed)
+            if len(batch) < Config.REAPER_BATCH_SIZE:
+                return reaped
+    
+    async def run_reaper(self, bot):
+        while True:
+            await asyncio.sleep(Config.REAPER_INTERVAL)
+            try:
+                await self.retry_waiters(bot)
+                reaped = await self.reap_idle(bot)
+                if reaped:
+                    logger.info(f"Ended {reaped} idle chats")
+            except Exception:
+                logger.exception("Idle reaper failed")
+    
+    def start_reaper(self, bot):
+        if self.reaper is None:
+            self.reaper = asyncio.create_task(self.run_reaper(bot))
+    
+    @property
+    def snapshots_enabled(self):
+        return bool(Config.SNAPSHOT_PATH) and not self.state.durable
+    
+    async def restore_state(self):
+        """Reload the pool and chats saved before a restart and end session rows left open without them"""
+        if not self.snapshots_enabled:
+            return
+        snapshot = load_snapshot(Config.SNAPSHOT_PATH, Config.SNAPSHOT_MAX_AGE)
+        # One query decides which saved chats are still open
+        open_rows = await self.db.aio.open_chat_sessions()
+        waiters, sessions = self.state.restore(snapshot, open_rows, Config.WAITING_TIMEOUT) if snapshot else ([], [])
+        
+        # Trackers resume the time already spent before the restart, longest first to keep their order
+        for user_id, bucket, _, waited in sorted(waiters, key=lambda waiter: -waiter[3]):
+            self.waiter_activity.touch(user_id, idle=waited)
+            self.match_fallback.touch(user_id, bucket, waited)
+        restored = set()
+        for session_id, user_a, user_b, idle in sorted(sessions, key=lambda session: -session[3]):
+            self.session_activity.touch(session_id, (user_a, user_b), idle)
+            self.recent_partners.record(user_a, user_b)
+            restored.add(session_id)
+        
+        # Chats opened after the last snapshot, or by a crashed process, can't be resumed
+        orphans = [
+            {'session_id': session_id, 'row_id': row_id}
+            for session_id, row_id in open_rows.items() if session_id not in restored
+        ]
+        if orphans:
+            await self.db.aio.end_chat_sessions(orphans)
+        logger.info(f"Restored {len(waiters)} waiting users and {len(sessions)} chats, ended {len(orphans)} stale chats")
+    
+    def save_state(self):
+        save_snapshot(Config.SNAPSHOT_PATH, self.state.snapshot())
+    
+    async def run_snapshots(self):
+        while True:
+            await asyncio.sleep(Config.SNAPSHOT_INTERVAL)
+            try:
+                # Copied on the loop so it is consistent, written off it
+                snapshot = self.state.snapshot()
+                await asyncio.to_thread(save_snapshot, Config.SNAPSHOT_PATH, snapshot)
+            except Exception:
+                logger.exception("State snapshot failed")
+    
+    def start_snapshots(self):
+        if self.snapshotter is None and self.snapshots_enabled:
+            self.snapshotter = asyncio.create_task(self.run_snapshots())
+    
+    async def close(self):
+        for task in (self.reaper, self.snapshotter):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if self.snapshotter:
+            # Final snapshot, the next process resumes from here
+            self.save_state()
+        await self.outbound.close()
+        await self.state.aio.close()
+
+async def start_background_tasks(application: Application):
+    """Resume saved state and start the bot's loop-bound background work once the Application is initialized"""
+    bot = application.bot_data['chat_bot']
+    profiler.register_loop_thread()
+    await bot.restore_state()
+    bot.start_reaper(application.bot)
+    bot.start_snapshots()
+
+async def stop_bot(application: Application):
+    """Stop background tasks, deliver pending sends and save the last snapshot while the Bot can still send"""
+    await application.bot_data['chat_bot'].close()
+
+async def shutdown_bot(application: Application):
+    """Flush buffered messages and drain pending database work before the process exits"""
+    close_database()
+
+def register_gauges(bot):
+    """Point the scrape-time gauges at this bot's matchmaking state and send queue"""
+    metrics.WAITING_USERS.set_function(lambda: {(bucket,): size for bucket, size in bot.state.waiting_sizes().items()})
+    metrics.ACTIVE_SESSIONS.set_function(bot.state.active_session_count)
+    metrics.OUTBOUND_QUEUE_DEPTH.set_function(lambda: bot.outbound.stats()['queue_depth'])
+    metrics.OUTBOUND_IN_FLIGHT.set_function(lambda: bot.outbound.stats()['in_flight'])
+    metrics.FLOOD_TRACKED_USERS.set_function(lambda: len(bot.flood))
+
+def build_application(webhook=False):
+    """Create the Application with all handlers registered, without starting it"""
+    builder = Application.builder().token(Config.BOT_TOKEN).post_init(start_background_tasks).post_stop(stop_bot).post_shutdown(shutdown_bot)
+    if Config.BOT_API_BASE_URL:
+        builder = builder.base_url(Config.BOT_API_BASE_URL)
+    if webhook:
+        # Updates are pushed to us over HTTP, no need for the polling Updater
+        builder = builder.updater(None)
+    if Config.CONCURRENT_UPDATES > 1:
+        # Different users are served in parallel, each user's updates stay in order
+        builder = builder.concurrent_updates(UserOrderedUpdateProcessor(Config.CONCURRENT_UPDATES))
+    application = builder.build()
+    
+    bot = AnonymousChatBot()
+    application.bot_data['chat_bot'] = bot
+    bot.db.start_maintenance()
+    
+    register_gauges(bot)
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", instrument_handler('start', bot.start)))
+    application.add_handler(CommandHandler("stop", instrument_handler('stop_chat', bot.stop_chat)))
+    application.add_handler(CommandHandler("interests", instrument_handler('set_interests', bot.set_interests)))
+    # Every kind of new message is relayed, edits and service messages are not
+    relayable = filters.UpdateType.MESSAGE & ~filters.COMMAND & ~filters.StatusUpdate.ALL
+    application.add_handler(MessageHandler(relayable, instrument_handler('handle_message', bot.handle_message)))
+    application.add_handler(CallbackQueryHandler(instrument_handler('button_handler', bot.button_handler), pattern='^(start_chat|set_gender|help)$'))
+    application.add_handler(CallbackQueryHandler(instrument_handler('gender_handler', bot.gender_handler), pattern='^gender_'))
+    return application
 
 def setup_bot():
     """Setup and run the bot for Replit"""
@@ -274,16 +517,7 @@ def setup_bot():
         print("❌ BOT_TOKEN not set! Please add it in Replit Secrets")
         return
     
-    application = Application.builder().token(Config.BOT_TOKEN).build()
-    
-    bot = AnonymousChatBot()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(CommandHandler("stop", bot.stop_chat))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
-    application.add_handler(CallbackQueryHandler(bot.button_handler, pattern='^(start_chat|set_gender|help)$'))
-    application.add_handler(CallbackQueryHandler(bot.gender_handler, pattern='^gender_'))
+    application = build_application()
     
     print("✅ Bot setup complete - Starting polling...")
     application.run_polling()
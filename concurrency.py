@@ -0,0 +1,58 @@
+import asyncio
+from contextlib import asynccontextmanager
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class KeyedLocks:
+    """asyncio locks created on demand per key and dropped once nobody holds or waits on them"""
+    def __init__(self):
+        self.locks = {}  # key -> [lock, users]
+
+    def __len__(self):
+        return len(self.locks)
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+
+    Updates from different users run in parallel up to max_concurrent_updates;
+    updates from the same user wait for the previous one to finish, in
+    arrival order. Updates without a user are not serialized. An update only
+    takes one of the concurrency slots once it is at the head of its user's
+    queue, so a burst from one user occupies a single slot and never holds
+    up everybody else.
+    """
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.user_locks = KeyedLocks()
+
+    async def process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+        # The user's lock first, the shared semaphore (taken by the base class) second
+        async with self.user_locks.hold(user.id):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -6,9 +6,24 @@ load_dotenv()
 class Config:
     # Telegram Bot Token - for Replit
     BOT_TOKEN = os.getenv('BOT_TOKEN')
+    BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL')  # e.g. a local fake Bot API, None for Telegram
+    
+    # Update delivery: 'polling', or 'webhook' where Telegram POSTs updates to WEBHOOK_PATH
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public https URL of WEBHOOK_PATH, registered on startup
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    UPDATE_MODE = os.getenv('UPDATE_MODE', 'webhook' if WEBHOOK_URL else 'polling')
     
     # Database - Use SQLite for Replit
-    DATABASE_URL = 'sqlite:///chatbot.db'
+    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///chatbot.db')
+    DB_POOL_SIZE = 10
+    DB_MAX_OVERFLOW = 20
+    
+    # SQLite tuning applied to every connection
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # safe with WAL, skips the fsync on every commit
+    SQLITE_BUSY_TIMEOUT = 5000  # ms
+    SQLITE_CACHE_SIZE_KB = 65536
+    SQLITE_MMAP_SIZE = 268435456
     
     # Admin credentials
     ADMINS = {
@@ -16,6 +31,78 @@ class Config:
         'admin2': {'password': 'admin456', 'name': 'Team Member 2'}
     }
     
+    # Bearer token that lets a Prometheus scraper read /admin/api/metrics without logging in
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    
+    # Updates slower than this many seconds are logged with a db/matchmaking/outbound breakdown (0 disables)
+    SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', 0))
+    
+    # Sampling profiles of the bot's event loop requested from the dashboard
+    PROFILE_MAX_SECONDS = 30
+    PROFILE_INTERVAL = 0.005  # seconds between stack samples
+    PROFILE_TOP_STACKS = 20
+    
+    # Live matchmaking state: 'memory' for a single worker, 'sqlite' to share it between workers
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'chatbot_state.db')
+    STATE_FLUSH_INTERVAL = 5  # seconds between writes of the sqlite backend's message counts
+    
+    # User profile cache in front of the users table. Each worker has its own, and a gender or
+    # interests change only clears the cache of the worker that handled it, so with workers
+    # sharing the sqlite state backend entries expire quickly and others catch up within the TTL
+    USER_CACHE_SIZE = 100000
+    USER_CACHE_TTL = 600 if STATE_BACKEND == 'memory' else 30
+    
+    # Interest matching: searches prefer shared interests, then take anyone after INTEREST_MATCH_WAIT seconds
+    MAX_INTERESTS = 10
+    INTEREST_MATCH_WAIT = 30
+    INTEREST_SCAN_LIMIT = 64  # waiters looked at per interest tag and bucket
+    
+    # Searches pass over each user's last RECENT_PARTNERS partners while anyone else is waiting
+    RECENT_PARTNERS = 5
+    RECENT_PARTNERS_MAX_USERS = 100000
+    
+    # Updates processed in parallel (per-user order is kept), 1 for strictly sequential
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 256))
+    
+    # Per-user flood control on relayed messages: FLOOD_BURST at once, then FLOOD_RATE per second
+    FLOOD_RATE = 1.0
+    FLOOD_BURST = 10
+    FLOOD_NOTICE_INTERVAL = 10  # seconds between "slow down" notices to one user
+    FLOOD_MAX_USERS = 100000
+    
+    # Outbound Bot API limits (messages per second)
+    SEND_GLOBAL_RATE = 30
+    SEND_GLOBAL_BURST = 30
+    SEND_CHAT_RATE = 1
+    SEND_CHAT_BURST = 5
+    SEND_MAX_RETRIES = 3
+    SEND_RETRY_BACKOFF = 0.5
+    
     # Surveillance settings
-    MESSAGE_LOG_SIZE = 1000
+    # 'logged' stores every relayed message, 'ephemeral' only keeps per-user/per-session counts
+    RELAY_MODE = os.getenv('RELAY_MODE', 'logged')
+    MESSAGE_LOG_SIZE = 1000  # messages kept, oldest are pruned first (0 keeps everything)
+    MESSAGE_MAX_AGE_DAYS = 0  # also prune messages older than this (0 disables)
+    RETENTION_INTERVAL = 60
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_MAX_BATCHES = 100
+    RETENTION_BATCH_PAUSE = 0.05
+    VACUUM_INTERVAL = 86400
+    VACUUM_PAGES = 2000  # pages returned per incremental vacuum run
+    VACUUM_FREE_RATIO = 0.25  # full VACUUM threshold when incremental mode is off
+    MESSAGE_FLUSH_SIZE = 500
+    MESSAGE_FLUSH_INTERVAL = 1.0
+    COUNTER_RECONCILE_INTERVAL = 3600
+    BAN_REFRESH_INTERVAL = 60  # reload the banned-user set to pick up bans made elsewhere
+    
+    # Chats idle this long are ended, searches this old are dropped
     USER_SESSION_TIMEOUT = 3600
+    WAITING_TIMEOUT = 900
+    REAPER_INTERVAL = 10
+    REAPER_BATCH_SIZE = 500
+    
+    # Memory-backend state is snapshotted here and reloaded after a restart (empty disables)
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'chatbot_snapshot.json')
+    SNAPSHOT_INTERVAL = 30
+    SNAPSHOT_MAX_AGE = 600  # older snapshots are ignored and every open chat is ended
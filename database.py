@@ -1,8 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import create_engine, make_url, event, func, select, update, Column, Integer, String, Text, DateTime, Boolean, JSON, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime
+import fcntl
+import functools
 import json
+import logging
+import threading
+import time
+from cache import LRUCache
+from config import Config
+import metrics
+from tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -52,39 +67,227 @@ class AdminLog(Base):
     action = Column(String(200))
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
+def create_database_engine(db_url):
+    """Engine with a sized connection pool and WAL and cache tuning on every connection"""
+    # Upserts, PRAGMAs and maintenance are written for SQLite only
+    if make_url(db_url).get_backend_name() != 'sqlite':
+        raise ValueError(f"Unsupported DATABASE_URL {db_url!r}: only SQLite databases are supported")
+    
+    if ':memory:' in db_url or db_url in ('sqlite://', 'sqlite:///'):
+        # An in-memory database lives in one connection, every thread must be handed that same one
+        engine = create_engine(db_url, poolclass=StaticPool, connect_args={'check_same_thread': False})
+    else:
+        engine = create_engine(
+            db_url,
+            pool_size=Config.DB_POOL_SIZE,
+            max_overflow=Config.DB_MAX_OVERFLOW,
+            connect_args={'timeout': Config.SQLITE_BUSY_TIMEOUT / 1000, 'check_same_thread': False}
+        )
+    
+    @event.listens_for(engine, 'connect')
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets dashboard readers run alongside the bot's writer
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA busy_timeout={int(Config.SQLITE_BUSY_TIMEOUT)}')
+        cursor.execute(f'PRAGMA cache_size={-int(Config.SQLITE_CACHE_SIZE_KB)}')
+        cursor.execute(f'PRAGMA mmap_size={int(Config.SQLITE_MMAP_SIZE)}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+    
+    return engine
+
+class SystemCounter(Base):
+    __tablename__ = 'system_counters'
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+# How each counter is recomputed from scratch when reconciling
+COUNTER_QUERIES = {
+    'total_users': select(func.count()).select_from(User),
+    'total_messages': select(func.count()).select_from(Message),
+    'active_sessions': select(func.count()).select_from(ChatSession).where(ChatSession.end_time.is_(None)),
+    'banned_users': select(func.count()).select_from(User).where(User.is_banned == True)
+}
+
 class Database:
     def __init__(self, db_url=None):
-        # Use SQLite for Replit
-        self.engine = create_engine('sqlite:///chatbot.db')
-        Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # Schema is managed by migrations.py, applied once from init_db.py
+        self.engine = create_database_engine(db_url or Config.DATABASE_URL)
+        # One session per thread: Flask request threads and the bot's DB executor never share one
+        self.Session = scoped_session(sessionmaker(bind=self.engine, expire_on_commit=False))
+        self.message_buffer = MessageBuffer(self)
+        self.user_cache = LRUCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)  # user_id -> profile
+        self.counter_reconciler = PeriodicTask(Config.COUNTER_RECONCILE_INTERVAL, self.reconcile_counters, 'counter-reconcile')
+        self.retention = MessageRetention(self)
+        self.maintenance_lock = None  # held open while this process runs the database-wide jobs
+        # Banned user ids, swapped as a whole on reload so readers never see a partial set
+        self.banned_users = frozenset()
+        self.ban_lock = threading.Lock()  # a reload can't overwrite a ban made while it ran
+        self.ban_refresher = PeriodicTask(Config.BAN_REFRESH_INTERVAL, self.load_banned_users, 'ban-refresh')
+        self.aio = AsyncDatabase(self)
         print("✅ SQLite Database connected successfully")
     
+    @property
+    def session(self):
+        return self.Session()
+    
+    def remove_session(self):
+        """Release the calling thread's session, e.g. at the end of a web request"""
+        self.Session.remove()
+    
+    def _commit(self):
+        try:
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+    
     def add_user(self, user_data):
         user = User(**user_data)
         self.session.add(user)
-        self.session.commit()
+        self.bump_counters(self.session, total_users=1, banned_users=1 if user.is_banned else 0)
+        self._commit()
         return user
     
-    def log_message(self, session_id, from_user_id, to_user_id, message_text, message_type='text'):
-        message = Message(
-            session_id=session_id,
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            message_text=message_text,
-            message_type=message_type
+    def get_or_create_user(self, user_id, username=None, first_name=None, last_name=None):
+        """Insert the user, or refresh their names if they exist, and cache their profile; return True if a row was created"""
+        now = datetime.datetime.utcnow()
+        statement = sqlite_insert(User).values(
+            user_id=user_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            join_date=now,
+            is_banned=False,
+            message_count=0,
+            last_active=now
         )
-        self.session.add(message)
+        statement = statement.on_conflict_do_nothing(
+            index_elements=[User.user_id]
+        ).returning(User.gender, User.is_banned, User.interests)
+        try:
+            # RETURNING only yields a row when the INSERT went through. An upsert would be one
+            # statement, but SQLite's RETURNING can't tell an inserted row from an updated one
+            row = self.session.execute(statement).one_or_none()
+            created = row is not None
+            if created:
+                self.bump_counters(self.session, total_users=1)
+            else:
+                row = self.session.execute(
+                    update(User).where(User.user_id == user_id)
+                    .values(username=username, first_name=first_name, last_name=last_name)
+                    .returning(User.gender, User.is_banned, User.interests)
+                ).one()
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
         
-        # Update user message count
-        user = self.session.query(User).filter_by(user_id=from_user_id).first()
-        if user:
-            user.message_count += 1
-            user.last_active = datetime.datetime.utcnow()
+        self._cache_profile(user_id, row.gender, row.is_banned, row.interests)
+        return created
+    
+    def _cache_profile(self, user_id, gender, is_banned, interests):
+        self.user_cache.set(user_id, {'gender': gender, 'is_banned': bool(is_banned), 'interests': interests or []})
+    
+    def get_user_profile(self, user_id):
+        """Cached {'gender', 'is_banned', 'interests'} for a user, or None if they are unknown"""
+        profile = self.user_cache.get(user_id)
+        if profile is not None:
+            return profile
         
-        self.session.commit()
-        return message
+        row = self.session.query(User.gender, User.is_banned, User.interests).filter_by(user_id=user_id).first()
+        if not row:
+            return None
+        self._cache_profile(user_id, row.gender, row.is_banned, row.interests)
+        return self.user_cache.get(user_id)
+    
+    def set_user_gender(self, user_id, gender):
+        updated = self.session.query(User).filter_by(user_id=user_id).update({'gender': gender})
+        self._commit()
+        self.user_cache.invalidate(user_id)
+        return bool(updated)
+    
+    def set_user_interests(self, user_id, interests):
+        updated = self.session.query(User).filter_by(user_id=user_id).update({'interests': list(interests)})
+        self._commit()
+        self.user_cache.invalidate(user_id)
+        return bool(updated)
+    
+    def set_user_banned(self, user_id, banned=True):
+        # Only rows whose flag actually flips count towards banned_users
+        updated = self.session.query(User).filter(
+            User.user_id == user_id,
+            User.is_banned != banned
+        ).update({'is_banned': banned})
+        if updated:
+            self.bump_counters(self.session, banned_users=1 if banned else -1)
+        self._commit()
+        self.user_cache.invalidate(user_id)
+        with self.ban_lock:
+            if banned:
+                self.banned_users = self.banned_users | {user_id}
+            else:
+                self.banned_users = self.banned_users - {user_id}
+        return bool(updated)
+    
+    def is_banned(self, user_id):
+        """In-memory ban check, cheap enough to run before any other work on an update"""
+        return user_id in self.banned_users
+    
+    def load_banned_users(self):
+        # Served by the ix_users_banned partial index, also picks up bans made by other processes
+        with self.ban_lock, self.engine.connect() as conn:
+            self.banned_users = frozenset(conn.execute(select(User.user_id).where(User.is_banned == True)).scalars())
+        return len(self.banned_users)
+    
+    def create_chat_session(self, session_id, user1_id, user2_id):
+        """Insert the session row and return its primary key"""
+        chat_session = ChatSession(
+            session_id=session_id,
+            user1_id=user1_id,
+            user2_id=user2_id
+        )
+        self.session.add(chat_session)
+        self.bump_counters(self.session, active_sessions=1)
+        self._commit()
+        return chat_session.id
+    
+    def end_chat_session(self, session_id, row_id=None, message_count=None):
+        return self.end_chat_sessions([{'session_id': session_id, 'row_id': row_id, 'message_count': message_count}]) > 0
+    
+    def end_chat_sessions(self, sessions):
+        """Close many sessions in one transaction, return how many were still open.
+
+        sessions are dicts as returned by the state backend. Rows are updated
+        by primary key when row_id is known, by session_id otherwise, and
+        message_count is written when given.
+        """
+        now = datetime.datetime.utcnow()
+        table = ChatSession.__table__
+        by_row = [s for s in sessions if s.get('row_id') is not None]
+        by_session_id = [s for s in sessions if s.get('row_id') is None]
+        values = {
+            'end_time': bindparam('end_time'),
+            'message_count': func.coalesce(bindparam('message_count'), table.c.message_count)
+        }
+        ended = 0
+        if by_row:
+            ended += self.session.execute(
+                table.update().where(table.c.id == bindparam('row_id'), table.c.end_time.is_(None)).values(values),
+                [{'row_id': s['row_id'], 'end_time': now, 'message_count': s.get('message_count')} for s in by_row]
+            ).rowcount
+        if by_session_id:
+            ended += self.session.execute(
+                table.update().where(table.c.session_id == bindparam('sid'), table.c.end_time.is_(None)).values(values),
+                [{'sid': s['session_id'], 'end_time': now, 'message_count': s.get('message_count')} for s in by_session_id]
+            ).rowcount
+        if ended:
+            self.bump_counters(self.session, active_sessions=-ended)
+        self._commit()
+        return ended
     
     def get_all_users(self):
         return self.session.query(User).all()
@@ -99,3 +302,349 @@ class Database:
     
     def get_active_sessions(self):
         return self.session.query(ChatSession).filter(ChatSession.end_time == None).all()
+    
+    def open_chat_sessions(self):
+        """{session_id: row id} of every session without an end_time, in one query"""
+        # Served by the ix_chat_sessions_open partial index
+        with self.engine.connect() as conn:
+            return dict(conn.execute(
+                select(ChatSession.session_id, ChatSession.id).where(ChatSession.end_time.is_(None))
+            ).all())
+    
+    def bump_counters(self, conn, **deltas):
+        """Adjust system counters inside the caller's transaction (session or connection)"""
+        params = [{'counter': name, 'delta': delta} for name, delta in deltas.items() if delta]
+        if params:
+            conn.execute(
+                SystemCounter.__table__.update()
+                .where(SystemCounter.name == bindparam('counter'))
+                .values(value=SystemCounter.value + bindparam('delta')),
+                params
+            )
+    
+    def get_counters(self):
+        """All system counters in one primary-key read, independent of table sizes"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(SystemCounter.name, SystemCounter.value)).all()
+        counters = {name: 0 for name in COUNTER_QUERIES}
+        counters.update({row.name: row.value for row in rows})
+        return counters
+    
+    def reconcile_counters(self):
+        """Recompute every counter from its table and correct any drift, return the corrections"""
+        before = self.get_counters()
+        with self.engine.begin() as conn:
+            for name, query in COUNTER_QUERIES.items():
+                # Each counter is reset by a single UPDATE ... SET value = (SELECT COUNT(*) ...)
+                conn.execute(update(SystemCounter).where(SystemCounter.name == name).values(value=query.scalar_subquery()))
+        after = self.get_counters()
+        drift = {name: after[name] - before[name] for name in after if after[name] != before[name]}
+        if drift:
+            logger.warning(f"Corrected system counter drift: {drift}")
+        return drift
+    
+    def start_maintenance(self):
+        """Start background upkeep jobs: every process refreshes its bans, one process per database prunes and vacuums"""
+        self.load_banned_users()
+        self.ban_refresher.start()
+        if self.claim_maintenance():
+            self.counter_reconciler.start()
+            self.retention.start()
+    
+    def claim_maintenance(self):
+        """Whether this process runs retention, counter reconciliation and VACUUM for the database.
+        
+        Workers sharing a database file race for an exclusive lock on a file
+        next to it. The winner keeps it until it exits, when the OS releases
+        it; the others leave those jobs alone.
+        """
+        path = self.engine.url.database
+        if not path or path == ':memory:':
+            return True
+        lock = open(f'{path}.maintenance.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            logger.info("Database maintenance runs in another process")
+            return False
+        self.maintenance_lock = lock
+        return True
+    
+    def close(self):
+        self.ban_refresher.stop()
+        self.counter_reconciler.stop()
+        self.retention.close()
+        if self.maintenance_lock:
+            self.maintenance_lock.close()
+        self.message_buffer.close()
+        self.aio.close()
+        self.Session.remove()
+        self.engine.dispose()
+
+class MessageBuffer:
+    """Write-behind buffer for relayed messages.
+
+    Message rows and per-user counter deltas accumulate in memory and are
+    written in a single transaction once MESSAGE_FLUSH_SIZE rows are queued
+    or every MESSAGE_FLUSH_INTERVAL seconds, whichever comes first. A batch
+    whose transaction fails goes back into the buffer and is retried on the
+    next flush. Anything still buffered is flushed on close(). With
+    store_bodies off (RELAY_MODE = 'ephemeral') only the counters are kept,
+    so relaying a message costs no I/O at all.
+    """
+    def __init__(self, db, max_size=None, flush_interval=None, store_bodies=None):
+        self.db = db
+        self.max_size = max_size or Config.MESSAGE_FLUSH_SIZE
+        self.flush_interval = flush_interval or Config.MESSAGE_FLUSH_INTERVAL
+        self.store_bodies = Config.RELAY_MODE != 'ephemeral' if store_bodies is None else store_bodies
+        self.messages = []
+        self.user_deltas = {}  # user_id -> [message_count delta, last_active]
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flusher = PeriodicTask(self.flush_interval, self.flush, 'message-flush')
+    
+    def add(self, session_id, from_user_id, to_user_id, message_text, message_type='text'):
+        """Buffer one message, return True when the size threshold is reached"""
+        now = datetime.datetime.utcnow()
+        with self.lock:
+            if self.store_bodies:
+                self.messages.append({
+                    'session_id': session_id,
+                    'from_user_id': from_user_id,
+                    'to_user_id': to_user_id,
+                    'message_text': message_text,
+                    'message_type': message_type,
+                    'timestamp': now,
+                    'is_reported': False
+                })
+            delta = self.user_deltas.get(from_user_id)
+            if delta:
+                delta[0] += 1
+                delta[1] = now
+            else:
+                self.user_deltas[from_user_id] = [1, now]
+            pending = len(self.messages)
+        
+        if self.flusher.thread is None:
+            self.flusher.start()
+        return pending >= self.max_size
+    
+    def flush(self):
+        """Write everything buffered so far in one transaction"""
+        with self.flush_lock:
+            with self.lock:
+                messages, self.messages = self.messages, []
+                user_deltas, self.user_deltas = self.user_deltas, {}
+            if not user_deltas:
+                return 0
+            
+            start = time.perf_counter()
+            try:
+                with self.db.engine.begin() as conn:
+                    if messages:
+                        conn.execute(Message.__table__.insert(), messages)
+                        self.db.bump_counters(conn, total_messages=len(messages))
+                    conn.execute(
+                        User.__table__.update()
+                        .where(User.user_id == bindparam('uid'))
+                        .values(
+                            message_count=User.message_count + bindparam('delta'),
+                            last_active=bindparam('ts')
+                        ),
+                        [{'uid': uid, 'delta': delta, 'ts': ts} for uid, (delta, ts) in user_deltas.items()]
+                    )
+            except Exception:
+                self._requeue(messages, user_deltas)
+                raise
+            metrics.DB_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            return sum(delta for delta, _ in user_deltas.values())
+    
+    def _requeue(self, messages, user_deltas):
+        # Put a failed batch back in front of whatever was buffered meanwhile
+        with self.lock:
+            self.messages[:0] = messages
+            for uid, (delta, ts) in user_deltas.items():
+                current = self.user_deltas.get(uid)
+                if current:
+                    current[0] += delta
+                else:
+                    self.user_deltas[uid] = [delta, ts]
+    
+    def close(self):
+        self.flusher.stop()
+        self.flush()
+
+class MessageRetention:
+    """Keeps the messages table bounded.
+
+    Rows beyond the newest MESSAGE_LOG_SIZE, or older than MESSAGE_MAX_AGE_DAYS,
+    are deleted oldest-first in small batches, each in its own short
+    transaction with a pause in between, so the bot's writes are never held
+    up for long. Freed pages are handed back to the filesystem separately.
+    """
+    def __init__(self, db, max_rows=None, max_age_days=None, batch_size=None):
+        self.db = db
+        self.max_rows = Config.MESSAGE_LOG_SIZE if max_rows is None else max_rows
+        self.max_age_days = Config.MESSAGE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        self.batch_size = batch_size or Config.RETENTION_BATCH_SIZE
+        self.pruner = PeriodicTask(Config.RETENTION_INTERVAL, self.prune, 'message-retention')
+        self.vacuumer = PeriodicTask(Config.VACUUM_INTERVAL, self.reclaim_space, 'message-vacuum')
+        self.deleted = 0
+    
+    def _cutoff_id(self, conn):
+        """Highest message id that falls outside the retention policy, or None"""
+        cutoffs = []
+        if self.max_rows:
+            cutoffs.append(conn.execute(
+                select(Message.id).order_by(Message.id.desc()).limit(1).offset(self.max_rows)
+            ).scalar())
+        if self.max_age_days:
+            oldest_allowed = datetime.datetime.utcnow() - datetime.timedelta(days=self.max_age_days)
+            cutoffs.append(conn.execute(
+                select(func.max(Message.id)).where(Message.timestamp < oldest_allowed)
+            ).scalar())
+        cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+        return max(cutoffs) if cutoffs else None
+    
+    def prune(self, max_batches=None):
+        """Delete expired messages batch by batch, return how many were removed"""
+        max_batches = max_batches or Config.RETENTION_MAX_BATCHES
+        with self.db.engine.connect() as conn:
+            cutoff_id = self._cutoff_id(conn)
+        if cutoff_id is None:
+            return 0
+        
+        deleted = 0
+        for batch in range(max_batches):
+            with self.db.engine.begin() as conn:
+                batch_ids = select(Message.id).where(Message.id <= cutoff_id).order_by(Message.id).limit(self.batch_size)
+                count = conn.execute(Message.__table__.delete().where(Message.id.in_(batch_ids.scalar_subquery()))).rowcount
+                self.db.bump_counters(conn, total_messages=-count)
+            deleted += count
+            if count < self.batch_size:
+                break
+            # Let the bot's writer in between batches
+            time.sleep(Config.RETENTION_BATCH_PAUSE)
+        
+        self.deleted += deleted
+        return deleted
+    
+    def reclaim_space(self):
+        """Return free pages to the filesystem and truncate the WAL"""
+        if self.db.engine.dialect.name != 'sqlite':
+            return
+        with self.db.engine.connect() as conn:
+            auto_vacuum = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+            free_pages = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            page_count = conn.exec_driver_sql('PRAGMA page_count').scalar()
+            if auto_vacuum == 2:
+                # incremental_vacuum frees one page per step, executescript steps it to completion
+                conn.connection.dbapi_connection.executescript(f'PRAGMA incremental_vacuum({Config.VACUUM_PAGES});')
+            elif page_count and free_pages / page_count > Config.VACUUM_FREE_RATIO:
+                conn.exec_driver_sql('VACUUM')
+            conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    
+    def start(self):
+        self.pruner.start()
+        self.vacuumer.start()
+    
+    def close(self):
+        self.pruner.stop()
+        self.vacuumer.stop()
+
+class AsyncDatabase:
+    """Awaitable facade over Database for use from the bot's event loop.
+
+    Every call is handed to a single dedicated worker thread, so the
+    synchronous session is only ever touched by that thread and a slow
+    SQLite commit never blocks other updates on the loop.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+    
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+        finally:
+            metrics.record_db_time(func.__name__, time.perf_counter() - start)
+    
+    async def get_or_create_user(self, user_id, username=None, first_name=None, last_name=None):
+        # Users already in the profile cache are known to exist, no need to leave the loop
+        if self.db.user_cache.get(user_id) is not None:
+            return False
+        return await self.run(self.db.get_or_create_user, user_id, username, first_name, last_name)
+    
+    async def get_user_profile(self, user_id):
+        profile = self.db.user_cache.get(user_id)
+        if profile is not None:
+            return profile
+        return await self.run(self.db.get_user_profile, user_id)
+    
+    async def set_user_gender(self, user_id, gender):
+        return await self.run(self.db.set_user_gender, user_id, gender)
+    
+    async def set_user_interests(self, user_id, interests):
+        return await self.run(self.db.set_user_interests, user_id, interests)
+    
+    async def set_user_banned(self, user_id, banned=True):
+        return await self.run(self.db.set_user_banned, user_id, banned)
+    
+    async def create_chat_session(self, session_id, user1_id, user2_id):
+        return await self.run(self.db.create_chat_session, session_id, user1_id, user2_id)
+    
+    async def end_chat_session(self, session_id, row_id=None, message_count=None):
+        return await self.run(self.db.end_chat_session, session_id, row_id, message_count)
+    
+    async def end_chat_sessions(self, sessions):
+        return await self.run(self.db.end_chat_sessions, sessions)
+    
+    async def open_chat_sessions(self):
+        return await self.run(self.db.open_chat_sessions)
+    
+    async def log_message(self, session_id, from_user_id, to_user_id, message_text, message_type='text'):
+        # Buffering is an in-memory append, only a full buffer costs a trip to the executor
+        if self.db.message_buffer.add(session_id, from_user_id, to_user_id, message_text, message_type):
+            try:
+                await self.run(self.db.message_buffer.flush)
+            except Exception:
+                # The batch stays buffered for the next flush, relaying must not fail because of it
+                logger.exception("Message flush failed, will retry")
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+# The process-wide Database shared by the bot and the dashboard, see get_database()
+_shared_database = None
+_shared_database_lock = threading.Lock()
+
+def get_database(create=True, verify=True):
+    """Return the shared Database, opening it and checking the schema on first use"""
+    global _shared_database
+    if _shared_database is None and create:
+        with _shared_database_lock:
+            if _shared_database is None:
+                database = Database(Config.DATABASE_URL)
+                if verify:
+                    verify_schema(database.engine)
+                _shared_database = database
+    return _shared_database
+
+def close_database():
+    """Flush and close the shared Database, the next get_database() opens a fresh one"""
+    global _shared_database
+    with _shared_database_lock:
+        database, _shared_database = _shared_database, None
+    if database is not None:
+        database.close()
+
+def verify_schema(engine):
+    # Migrations are applied by init_db.py, only warn here so forked workers never race each other
+    from migrations import pending_migrations
+    pending = pending_migrations(engine)
+    if pending:
+        logger.warning(f"Database schema is behind, run `python init_db.py` to apply migrations {[version for version, _, _ in pending]}")
+    return not pending
@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ExpiryTracker:
+    """Keys ordered by last activity, so touching one and finding the idle ones are both cheap.
+
+    Every key shares the same timeout, which means the least recently
+    touched key is always the first to expire: an OrderedDict kept in
+    touch order does the job of a timer wheel with O(1) touch and discard,
+    and expired() only ever looks at the keys it returns.
+    """
+    def __init__(self, timeout, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (last activity, value)
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def touch(self, key, value=None, idle=0):
+        """Mark key active now, or idle seconds ago.
+
+        The key still goes to the back of the order, so a back-dated key
+        touched after fresher ones expires late rather than early.
+        """
+        with self.lock:
+            self.entries[key] = (self.clock() - idle, value)
+            self.entries.move_to_end(key)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def expired(self, limit=None):
+        """Remove and return [(key, value)] for keys idle longer than the timeout, oldest first"""
+        cutoff = self.clock() - self.timeout
+        expired = []
+        with self.lock:
+            while self.entries and (limit is None or len(expired) < limit):
+                key, (last_activity, value) = next(iter(self.entries.items()))
+                if last_activity > cutoff:
+                    break
+                del self.entries[key]
+                expired.append((key, value))
+        return expired
@@ -0,0 +1,132 @@
+"""Local stand-ins for the Telegram Bot API, for load tests and offline runs.
+
+FakeBot is an in-process replacement for telegram.Bot that the handlers can
+call directly; updates built with make_message_update/make_callback_update
+are real telegram.Update objects bound to it. FakeBotAPIServer speaks enough
+of the HTTP Bot API for a real Application to run against it (point
+BOT_API_BASE_URL at its base_url).
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telegram import Update
+from telegram.error import RetryAfter
+
+class FakeBot:
+    """Records every Bot API call and answers it after an optional simulated latency"""
+    def __init__(self, latency=0.0, flood_every=0, flood_retry_after=0):
+        self.latency = latency
+        self.flood_every = flood_every  # raise RetryAfter on every Nth call, 0 disables
+        self.flood_retry_after = flood_retry_after
+        self.calls = []  # (monotonic time, method, chat_id, text)
+        self.call_count = 0
+        self.message_ids = itertools.count(1)
+        self.listeners = []
+
+    async def _call(self, method, chat_id=None, text=None):
+        self.call_count += 1
+        if self.flood_every and self.call_count % self.flood_every == 0:
+            raise RetryAfter(self.flood_retry_after)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        record = (time.monotonic(), method, chat_id, text)
+        self.calls.append(record)
+        for listener in self.listeners:
+            listener(record)
+        return next(self.message_ids)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call('sendMessage', chat_id, text)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        return await self._call('copyMessage', chat_id, None)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self._call('editMessageText', chat_id, text)
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        return await self._call('answerCallbackQuery')
+
+update_ids = itertools.count(1)
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+def _chat(user_id):
+    return {'id': user_id, 'type': 'private'}
+
+def make_message_update(bot, user_id, text):
+    update_id = next(update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': _chat(user_id),
+        'from': _user(user_id),
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return Update.de_json({'update_id': update_id, 'message': message}, bot)
+
+def make_callback_update(bot, user_id, data):
+    update_id = next(update_ids)
+    return Update.de_json({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': _user(user_id),
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': _chat(user_id), 'text': 'menu'}
+        }
+    }, bot)
+
+class FakeBotAPIServer:
+    """Minimal HTTP Bot API on localhost, every method succeeds"""
+    def __init__(self, port=0):
+        self.calls = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('content-length') or 0)
+                body = self.rfile.read(length)
+                method = self.path.rsplit('/', 1)[-1]
+                server.calls.append((method, body))
+                payload = json.dumps({'ok': True, 'result': server.result_for(method)}).encode()
+                self.send_response(200)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.httpd.server_port}/bot'
+
+    def result_for(self, method):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            return {'message_id': len(self.calls), 'date': int(time.time()), 'chat': _chat(0), 'text': ''}
+        if method == 'copyMessage':
+            return {'message_id': len(self.calls)}
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-bot-api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from config import Config
+from outbound import TokenBucket
+import metrics
+
+class UserAllowance:
+    __slots__ = ('bucket', 'noticed_at')
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.noticed_at = 0.0
+
+class FloodControl:
+    """Per-user token buckets in front of the relay path.
+
+    A user may send burst messages at once and rate per second after that;
+    anything beyond is dropped before it costs a database write or a Bot
+    API call. Users are told at most once per notice_interval that their
+    messages are being dropped. Buckets are kept in least-recently-used
+    order and the oldest are evicted past max_users, but only once they
+    have refilled to full, so forgetting one changes nothing. A bucket
+    refills within burst / rate seconds, which bounds how far past
+    max_users the senders of the last few seconds can push the count.
+    """
+    def __init__(self, rate=None, burst=None, notice_interval=None, max_users=None):
+        self.rate = rate or Config.FLOOD_RATE
+        self.burst = burst or Config.FLOOD_BURST
+        self.notice_interval = Config.FLOOD_NOTICE_INTERVAL if notice_interval is None else notice_interval
+        self.max_users = max_users or Config.FLOOD_MAX_USERS
+        self.users = OrderedDict()  # user_id -> UserAllowance
+        self.dropped = 0
+        self.notices = 0
+
+    def __len__(self):
+        return len(self.users)
+
+    def check(self, user_id):
+        """Return (allowed, notify): whether to handle this message and whether to tell the user it was dropped"""
+        allowance = self.users.get(user_id)
+        if allowance is None:
+            allowance = self.users[user_id] = UserAllowance(self.rate, self.burst)
+            while len(self.users) > self.max_users:
+                oldest = next(iter(self.users.values()))
+                if not oldest.bucket.is_full():
+                    # Evicting it would hand a fresh burst to someone still sending
+                    break
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_id)
+
+        if not allowance.bucket.try_acquire():
+            return True, False
+
+        self.dropped += 1
+        metrics.FLOOD_DROPPED.inc()
+        now = time.monotonic()
+        if now - allowance.noticed_at < self.notice_interval:
+            return False, False
+        allowance.noticed_at = now
+        self.notices += 1
+        return False, True
+
+    def stats(self):
+        return {'users': len(self.users), 'dropped': self.dropped, 'notices': self.notices}
@@ -1,14 +1,20 @@
-from database import Base, Database
-from config import Config
-import os
+from database import close_database, get_database, User
+from migrations import migrate, print_query_plans
+import sys
 
 def initialize_database():
-    db = Database(Config.DATABASE_URL)
+    # The shared instance, so a server started in this process reuses the same engine
+    db = get_database(verify=False)
+    migrate(db.engine)
     print("✅ Database initialized successfully!")
     
     # Test connection
-    users = db.session.query(db.User).all()
-    print(f"📊 Current users in database: {len(users)}")
+    user_count = db.session.query(User).count()
+    print(f"📊 Current users in database: {user_count}")
+    
+    if '--explain' in sys.argv:
+        print_query_plans(db.engine)
 
 if __name__ == '__main__':
     initialize_database()
+    close_database()
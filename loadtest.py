@@ -0,0 +1,240 @@
+"""Capacity benchmark for AnonymousChatBot with synthetic users and a fake Bot API.
+
+Runs entirely on this machine against a throwaway SQLite file:
+
+    python loadtest.py --users 2000 --messages 10
+    python loadtest.py --output baseline.json
+    python loadtest.py --compare baseline.json
+
+Every synthetic user sends /start, picks a gender, searches for a partner,
+relays messages and finally /stop. Updates go through the same per-user
+ordered processor the live bot uses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+
+# Config reads DATABASE_URL at import, so point it at a scratch file first
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'loadtest.db')}")
+
+from sqlalchemy import event
+import bot as bot_module
+from concurrency import UserOrderedUpdateProcessor
+from database import close_database, get_database
+from fake_telegram import FakeBot, make_callback_update, make_message_update
+from flood import FloodControl
+from migrations import migrate
+from outbound import OutboundScheduler
+from state import create_state_backend
+
+CONNECTED_PREFIX = "✅ **Connected!**"
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def latency_summary(values):
+    return {
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values, default=0) * 1000
+    }
+
+def measure_session_memory(sessions):
+    """Bytes the session registry holds per active chat, measured on a fresh backend"""
+    state = create_state_backend()
+    # Build the ids up front so only the registry's own allocations are counted
+    user_ids = list(range(1, sessions * 2 + 1))
+    session_ids = [f'session-{index}' for index in range(sessions)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for index in range(sessions):
+        state.enqueue(user_ids[2 * index], 'male')
+        state.pair(user_ids[2 * index + 1], 'female', session_ids[index])
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    state.close()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / sessions
+
+class LoadTest:
+    def __init__(self, users, messages, api_latency=0.0, rate_limits=False, concurrency=256):
+        self.users = users
+        self.messages = messages
+        self.fake_bot = FakeBot(latency=api_latency)
+        self.context = types.SimpleNamespace(bot=self.fake_bot)
+        if rate_limits:
+            outbound = OutboundScheduler()
+            flood = FloodControl()
+        else:
+            # Measure the bot itself, not Telegram's or our own flood limits
+            outbound = OutboundScheduler(global_rate=1e9, global_burst=1e9, chat_rate=1e9, chat_burst=1e9)
+            flood = FloodControl(rate=1e9, burst=1e9)
+        self.db = get_database(verify=False)
+        migrate(self.db.engine)
+        self.chat_bot = bot_module.AnonymousChatBot(outbound=outbound, db=self.db, flood=flood)
+        self.processor = UserOrderedUpdateProcessor(concurrency)
+        self.commits = 0
+        self.connected_at = {}  # user_id -> time the Connected! notice was delivered
+        self.fake_bot.listeners.append(self._on_api_call)
+
+    def _on_api_call(self, record):
+        sent_at, method, chat_id, text = record
+        if method == 'sendMessage' and text and text.startswith(CONNECTED_PREFIX):
+            self.connected_at.setdefault(chat_id, sent_at)
+
+    def _count_commit(self, conn):
+        self.commits += 1
+
+    async def dispatch(self, update, handler):
+        await self.processor.process_update(update, handler(update, self.context))
+
+    async def timed_dispatch(self, update, handler, latencies):
+        start = time.perf_counter()
+        await self.dispatch(update, handler)
+        latencies.append(time.perf_counter() - start)
+
+    async def run(self):
+        db = self.db
+        event.listen(db.engine, 'commit', self._count_commit)
+        user_ids = list(range(1, self.users + 1))
+        bot = self.chat_bot
+        results = {'users': self.users, 'messages_per_user': self.messages}
+
+        # Registration: /start and gender choice for everyone
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            self.dispatch(make_message_update(self.fake_bot, user_id, '/start'), bot.start)
+            for user_id in user_ids
+        ])
+        await asyncio.gather(*[
+            self.dispatch(
+                make_callback_update(self.fake_bot, user_id, 'gender_male' if user_id % 2 else 'gender_female'),
+                bot.gender_handler
+            )
+            for user_id in user_ids
+        ])
+        results['registration_per_sec'] = self.users / (time.perf_counter() - start)
+
+        # Matchmaking: everyone searches at once
+        search_latencies = []
+        searched_at = {}
+        start = time.perf_counter()
+        for user_id in user_ids:
+            searched_at[user_id] = time.monotonic()
+        await asyncio.gather(*[
+            self.timed_dispatch(make_callback_update(self.fake_bot, user_id, 'start_chat'), bot.button_handler, search_latencies)
+            for user_id in user_ids
+        ])
+        await bot.outbound.close()
+        results['search_per_sec'] = self.users / (time.perf_counter() - start)
+
+        active_sessions = bot.state.active_session_count()
+        results['active_sessions'] = active_sessions
+        results['search_latency'] = latency_summary(search_latencies)
+        results['time_to_match'] = latency_summary([
+            self.connected_at[user_id] - searched_at[user_id]
+            for user_id in user_ids if user_id in self.connected_at
+        ])
+        results['bytes_per_active_session'] = measure_session_memory(max(active_sessions, 1))
+
+        # Relay: every paired user sends their messages, one update after another per user
+        paired = [user_id for user_id in user_ids if bot.state.get_session(user_id)]
+        relay_latencies = []
+        commits_before = self.commits
+
+        async def chat(user_id):
+            for index in range(self.messages):
+                await self.timed_dispatch(
+                    make_message_update(self.fake_bot, user_id, f"message {index} from {user_id}"),
+                    bot.handle_message, relay_latencies
+                )
+
+        start = time.perf_counter()
+        await asyncio.gather(*[chat(user_id) for user_id in paired])
+        await bot.outbound.close()
+        # Include the write-behind flush so buffered rows are part of the measurement
+        await db.aio.run(db.message_buffer.flush)
+        relay_elapsed = time.perf_counter() - start
+        relayed = len(paired) * self.messages
+        results['relay_messages_per_sec'] = relayed / relay_elapsed if relay_elapsed else 0
+        results['relay_latency'] = latency_summary(relay_latencies)
+        results['relay_db_commits'] = self.commits - commits_before
+        results['relay_db_commits_per_sec'] = results['relay_db_commits'] / relay_elapsed if relay_elapsed else 0
+
+        # Teardown
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            self.dispatch(make_message_update(self.fake_bot, user_id, '/stop'), bot.stop_chat)
+            for user_id in paired
+        ])
+        results['stop_per_sec'] = len(paired) / (time.perf_counter() - start)
+
+        await bot.close()
+        close_database()
+        results['total_db_commits'] = self.commits
+        results['bot_api_calls'] = len(self.fake_bot.calls)
+        return results
+
+def print_report(results, baseline=None):
+    def row(label, key, value, unit='', better='higher'):
+        line = f"{label:<32} {value:>12.2f} {unit}"
+        if baseline and key in baseline and isinstance(baseline[key], (int, float)) and baseline[key]:
+            change = (value - baseline[key]) / baseline[key] * 100
+            line += f"   ({change:+.1f}% vs baseline, {better} is better)"
+        print(line)
+
+    print(f"\nLoad test: {results['users']} users, {results['messages_per_user']} messages each")
+    row('Registrations/sec', 'registration_per_sec', results['registration_per_sec'])
+    row('Searches/sec', 'search_per_sec', results['search_per_sec'])
+    for name in ('search_latency', 'time_to_match', 'relay_latency'):
+        for stat, value in results[name].items():
+            flat_key = f'{name}.{stat}'
+            row(f"{name.replace('_', ' ')} {stat[:-3]}", flat_key, value, 'ms', 'lower')
+    row('Relay messages/sec', 'relay_messages_per_sec', results['relay_messages_per_sec'])
+    row('DB commits during relay', 'relay_db_commits', results['relay_db_commits'], '', 'lower')
+    row('DB commits/sec during relay', 'relay_db_commits_per_sec', results['relay_db_commits_per_sec'], '', 'lower')
+    row('Active sessions', 'active_sessions', results['active_sessions'])
+    row('Memory per active session', 'bytes_per_active_session', results['bytes_per_active_session'], 'bytes', 'lower')
+    row('Stops/sec', 'stop_per_sec', results['stop_per_sec'])
+
+def flatten(results):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update({f'{key}.{stat}': stat_value for stat, stat_value in value.items()})
+        else:
+            flat[key] = value
+    return flat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=10, help='messages relayed per paired user')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='simulated Bot API latency in seconds')
+    parser.add_argument('--rate-limits', action='store_true', help="apply the production outbound and flood-control limits")
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON written by an earlier --output run')
+    args = parser.parse_args()
+
+    results = asyncio.run(LoadTest(args.users, args.messages, args.api_latency, args.rate_limits).run())
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(flatten(results) | results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(flatten(results), f, indent=2)
+
+if __name__ == '__main__':
+    main()
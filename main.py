@@ -1,28 +1,17 @@
 import os
-import threading
-from admin_dashboard import app
-from bot import setup_bot
+import uvicorn
+from init_db import initialize_database
 
 print("🚀 Starting Anonymous Chat Bot...")
 
 # Set environment variables for Replit
 os.environ['BOT_TOKEN'] = os.getenv('BOT_TOKEN')
 
-def start_bot():
-    """Start the Telegram bot"""
-    try:
-        print("🤖 Initializing Telegram Bot...")
-        setup_bot()
-    except Exception as e:
-        print(f"❌ Bot error: {e}")
-
 if __name__ == '__main__':
-    # Start bot in background thread
-    print("🔄 Starting bot thread...")
-    bot_thread = threading.Thread(target=start_bot)
-    bot_thread.daemon = True
-    bot_thread.start()
+    # Bring the schema up to date before either half touches the database
+    initialize_database()
     
-    # Start Flask web dashboard
-    print("🌐 Starting web dashboard...")
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    # Bot updates (polling or webhook) and the web dashboard share one event loop
+    print("🌐 Starting bot and web dashboard...")
+    from asgi import app
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,240 @@
+import itertools
+import time
+from collections import OrderedDict, deque
+from config import Config
+
+def normalize_interests(raw):
+    """Lower-cased, de-duplicated interest tags, at most Config.MAX_INTERESTS of them"""
+    if isinstance(raw, str):
+        raw = raw.replace(',', ' ').split()
+    tags = []
+    for tag in raw or ():
+        tag = str(tag).strip().lstrip('#').lower()[:32]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:Config.MAX_INTERESTS]
+
+class RecentPartners:
+    """Each user's last `size` chat partners, so a search can pass them over.
+
+    Histories are fixed-size rings kept in least-recently-used order and the
+    oldest are forgotten past max_users, which bounds the total footprint.
+    Every remembered pair is also counted in one dict keyed by the pair, so
+    avoids() is a single lookup however long the histories are. A size of 0
+    disables it: nothing is recorded and nobody is avoided.
+    """
+    def __init__(self, size=None, max_users=None):
+        self.size = Config.RECENT_PARTNERS if size is None else size
+        self.max_users = Config.RECENT_PARTNERS_MAX_USERS if max_users is None else max_users
+        self.history = OrderedDict()  # user_id -> deque of partner ids, newest last
+        self.pairs = {}  # (lower id, higher id) -> number of histories holding the pair
+
+    def __len__(self):
+        return len(self.history)
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    @staticmethod
+    def _key(user_a, user_b):
+        return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
+    def _release(self, user_a, user_b):
+        key = self._key(user_a, user_b)
+        held = self.pairs[key] - 1
+        if held:
+            self.pairs[key] = held
+        else:
+            del self.pairs[key]
+
+    def _push(self, user_id, partner_id):
+        ring = self.history.get(user_id)
+        if ring is None:
+            ring = self.history[user_id] = deque(maxlen=self.size)
+            while len(self.history) > self.max_users:
+                forgotten, old_ring = self.history.popitem(last=False)
+                for old_partner in old_ring:
+                    self._release(forgotten, old_partner)
+        else:
+            self.history.move_to_end(user_id)
+        if len(ring) == self.size:
+            self._release(user_id, ring[0])
+        ring.append(partner_id)
+        key = self._key(user_id, partner_id)
+        self.pairs[key] = self.pairs.get(key, 0) + 1
+
+    def record(self, user_a, user_b):
+        if not self.enabled:
+            return
+        self._push(user_a, user_b)
+        self._push(user_b, user_a)
+
+    def avoids(self, user_a, user_b):
+        return self._key(user_a, user_b) in self.pairs
+
+    def partners_of(self, user_id):
+        return tuple(self.history.get(user_id, ()))
+
+class MatchmakingQueue:
+    """Waiting pool of users looking for a chat partner.
+
+    Each gender bucket is an insertion-ordered FIFO and every waiting user is
+    indexed by id, so joining, leaving and pairing are O(1) regardless of how
+    many users are waiting. Within a bucket waiters are also indexed by
+    interest tag, and a search only reads the oldest scan_limit waiters of
+    each of its own tags, so interest matching stays independent of the
+    pool size too.
+    """
+    BUCKETS = ('male', 'female', 'any')
+
+    # Buckets a searcher may be paired from, in order of preference
+    CANDIDATES = {
+        'male': ('female', 'any'),
+        'female': ('male', 'any'),
+        'any': ('any',)
+    }
+
+    def __init__(self, interest_wait=None, scan_limit=None, clock=time.monotonic):
+        self.interest_wait = Config.INTEREST_MATCH_WAIT if interest_wait is None else interest_wait
+        self.scan_limit = scan_limit or Config.INTEREST_SCAN_LIMIT
+        self.clock = clock
+        self.buckets = {gender: OrderedDict() for gender in self.BUCKETS}  # user_id -> (interests, enqueued at)
+        self.interest_index = {gender: {} for gender in self.BUCKETS}  # tag -> OrderedDict of user_ids
+        self.plain = {gender: OrderedDict() for gender in self.BUCKETS}  # waiters without interests
+        self.members = {}  # user_id -> bucket
+
+    def __contains__(self, user_id):
+        return user_id in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    @classmethod
+    def bucket_for(cls, gender):
+        return gender if gender in cls.BUCKETS else 'any'
+
+    def add(self, user_id, gender, interests=(), waited=0):
+        """Queue a user, return False if they were already waiting in that bucket with those interests
+
+        waited backdates the entry, e.g. for a waiter restored from a snapshot.
+        """
+        bucket = self.bucket_for(gender)
+        interests = frozenset(interests)
+        current = self.members.get(user_id)
+        if current == bucket and self.buckets[bucket][user_id][0] == interests:
+            return False
+        if current is not None:
+            self.remove(user_id)
+        self.buckets[bucket][user_id] = (interests, self.clock() - waited)
+        for tag in interests:
+            self.interest_index[bucket].setdefault(tag, OrderedDict())[user_id] = None
+        if not interests:
+            self.plain[bucket][user_id] = None
+        self.members[user_id] = bucket
+        return True
+
+    def remove(self, user_id):
+        bucket = self.members.pop(user_id, None)
+        if bucket is None:
+            return False
+        interests, _ = self.buckets[bucket].pop(user_id)
+        index = self.interest_index[bucket]
+        for tag in interests:
+            postings = index[tag]
+            del postings[user_id]
+            if not postings:
+                del index[tag]
+        self.plain[bucket].pop(user_id, None)
+        return True
+
+    def _first_usable(self, waiters, usable):
+        for candidate in waiters:
+            if usable(candidate):
+                return candidate
+        return None
+
+    def pop_partner(self, user_id, gender, is_available=None, avoid=None):
+        """Find the best compatible partner for user_id.
+
+        The waiter sharing the most interests with user_id wins, the longer
+        wait breaks ties. Without a shared interest a pair is only made when
+        one side has waited interest_wait seconds, or neither side has any
+        interests; then the longest-waiting compatible user is taken.
+        Candidates for whom avoid(candidate) is true (recent partners) are
+        passed over, unless nobody else is left once one side has waited
+        interest_wait seconds.
+
+        On success both users are taken out of the pool and the partner id is
+        returned. Candidates rejected by is_available are dropped from the
+        pool as they are encountered, so they are never scanned twice.
+        """
+        candidate_buckets = self.CANDIDATES[self.bucket_for(gender)]
+        own_bucket = self.members.get(user_id)
+        interests, enqueued_at = self.buckets[own_bucket][user_id] if own_bucket else (frozenset(), self.clock())
+        cutoff = self.clock() - self.interest_wait
+        stale = set()
+
+        def usable(candidate):
+            if candidate == user_id or candidate in stale:
+                return False
+            if is_available is not None and not is_available(candidate):
+                stale.add(candidate)
+                return False
+            return True
+
+        def fresh(candidate):
+            return usable(candidate) and not (avoid is not None and avoid(candidate))
+
+        partner_id = None
+        if interests:
+            scores = {}
+            for bucket_name in candidate_buckets:
+                index = self.interest_index[bucket_name]
+                for tag in interests:
+                    for candidate in itertools.islice(index.get(tag, ()), self.scan_limit):
+                        if fresh(candidate):
+                            scores[candidate] = scores.get(candidate, 0) + 1
+            if scores:
+                partner_id = max(
+                    scores,
+                    key=lambda candidate: (scores[candidate], -self.buckets[self.members[candidate]][candidate][1])
+                )
+
+        if partner_id is None:
+            for bucket_name in candidate_buckets:
+                oldest = self._first_usable(self.buckets[bucket_name], fresh)
+                if oldest is not None and (enqueued_at <= cutoff or self.buckets[bucket_name][oldest][1] <= cutoff):
+                    partner_id = oldest
+                elif not interests:
+                    partner_id = self._first_usable(self.plain[bucket_name], fresh)
+                if partner_id is not None:
+                    break
+
+        if partner_id is None and avoid is not None:
+            # Too few waiters to avoid recent partners, pair again after the same wait
+            for bucket_name in candidate_buckets:
+                oldest = self._first_usable(self.buckets[bucket_name], usable)
+                if oldest is not None and (enqueued_at <= cutoff or self.buckets[bucket_name][oldest][1] <= cutoff):
+                    partner_id = oldest
+                    break
+
+        for candidate in stale:
+            self.remove(candidate)
+
+        if partner_id is not None:
+            self.remove(partner_id)
+            self.remove(user_id)
+        return partner_id
+
+    def dump(self):
+        """[(user_id, bucket, interests, seconds waited)] in queue order, what add() needs to rebuild the pool"""
+        now = self.clock()
+        return [
+            (user_id, bucket_name, sorted(interests), now - enqueued_at)
+            for bucket_name, bucket in self.buckets.items()
+            for user_id, (interests, enqueued_at) in bucket.items()
+        ]
+
+    def sizes(self):
+        return {gender: len(bucket) for gender, bucket in self.buckets.items()}
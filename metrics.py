@@ -0,0 +1,235 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Metrics are plain objects in a module-level registry, safe to update from
+the bot's event loop and worker threads and to render from a dashboard
+request thread. Gauges are usually backed by a function that is evaluated
+at scrape time, so nothing has to keep them up to date.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in values.items()
+        ]
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Compute the gauge at scrape time, function returns a number or {label tuple: number}"""
+        self.function = function
+
+    def render(self):
+        if self.function is not None:
+            result = self.function()
+            values = result if isinstance(result, dict) else {(): result}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in values.items()
+        ]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label tuple -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        lines = self.header()
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {values[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {values[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {values[-1]}')
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} unavailable: {e}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram('bot_handler_seconds', 'Time spent handling one update', ['handler'])
+HANDLER_ERRORS = registry.counter('bot_handler_errors_total', 'Updates whose handler raised', ['handler', 'error'])
+UPDATE_DB_SECONDS = registry.histogram('bot_update_db_seconds', 'Time one update spent waiting on the database', ['handler'])
+DB_CALL_SECONDS = registry.histogram('db_call_seconds', 'Database calls made from the bot, including executor queueing', ['method'])
+DB_FLUSH_SECONDS = registry.histogram('db_message_flush_seconds', 'Group commits of the message buffer')
+BOT_API_SECONDS = registry.histogram('bot_api_call_seconds', 'Outbound Bot API calls', ['method'])
+BOT_API_ERRORS = registry.counter('bot_api_errors_total', 'Outbound Bot API calls that failed', ['method', 'error'])
+WAITING_USERS = registry.gauge('matchmaking_waiting_users', 'Users waiting for a partner', ['bucket'])
+ACTIVE_SESSIONS = registry.gauge('matchmaking_active_sessions', 'Chats currently open')
+OUTBOUND_QUEUE_DEPTH = registry.gauge('outbound_queue_depth', 'Sends waiting for a rate-limit token')
+OUTBOUND_IN_FLIGHT = registry.gauge('outbound_in_flight', 'Sends currently awaiting the Bot API')
+FLOOD_DROPPED = registry.counter('bot_flood_dropped_total', 'Messages dropped by per-user flood control')
+FLOOD_TRACKED_USERS = registry.gauge('bot_flood_tracked_users', 'Users with a flood-control bucket in memory')
+SLOW_UPDATES = registry.counter('bot_slow_updates_total', 'Updates slower than SLOW_UPDATE_THRESHOLD', ['handler'])
+
+class UpdateTrace:
+    """Time one update spent in each span (db, matchmaking, outbound), with how many times it entered it"""
+    __slots__ = ('spans',)
+
+    def __init__(self):
+        self.spans = {}  # span name -> [seconds, count]
+
+    def add(self, name, elapsed):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [elapsed, 1]
+        else:
+            span[0] += elapsed
+            span[1] += 1
+
+    def seconds(self, name):
+        return self.spans.get(name, (0.0,))[0]
+
+    def describe(self, total):
+        # Spans can overlap (e.g. two sends gathered), so "other" is never negative
+        parts = [f'{name} {seconds * 1000:.1f}ms/{count}' for name, (seconds, count) in sorted(self.spans.items())]
+        parts.append(f'other {max(0.0, total - sum(seconds for seconds, _ in self.spans.values())) * 1000:.1f}ms')
+        return ', '.join(parts)
+
+# Trace of the update currently being handled
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+def record_span(name, elapsed):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, elapsed)
+
+@contextlib.contextmanager
+def span(name):
+    """Time the block as one entry of span name in the current update's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+def record_db_time(method, elapsed):
+    DB_CALL_SECONDS.observe(elapsed, method=method)
+    record_span('db', elapsed)
+
+def instrument_handler(name, handler):
+    """Wrap an update handler with latency, error and per-update DB time metrics.
+
+    Updates slower than Config.SLOW_UPDATE_THRESHOLD seconds (0 disables)
+    are also logged with their span breakdown.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        trace = UpdateTrace()
+        token = current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HANDLER_SECONDS.observe(elapsed, handler=name)
+            UPDATE_DB_SECONDS.observe(trace.seconds('db'), handler=name)
+            current_trace.reset(token)
+            if Config.SLOW_UPDATE_THRESHOLD and elapsed >= Config.SLOW_UPDATE_THRESHOLD:
+                SLOW_UPDATES.inc(handler=name)
+                logger.warning(f"Slow update in {name}: {elapsed * 1000:.1f}ms ({trace.describe(elapsed)})")
+    return wrapper
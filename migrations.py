@@ -0,0 +1,128 @@
+"""Versioned schema migrations and query-plan report.
+
+Migrations are applied in order and recorded in the schema_version table,
+so running them again is a no-op. Run `python init_db.py` once per deploy;
+`python migrations.py --explain` prints the plan SQLite picks for each query
+the app issues, which should read SEARCH ... USING INDEX rather than SCAN.
+"""
+import datetime
+import sys
+from sqlalchemy import func, or_, select, text
+from database import Base, User, ChatSession, Message, AdminLog, SystemCounter, COUNTER_QUERIES
+
+def create_base_tables(conn):
+    # checkfirst keeps this safe on databases created before migrations existed
+    Base.metadata.create_all(conn, checkfirst=True)
+
+def seed_system_counters(conn):
+    SystemCounter.__table__.create(conn, checkfirst=True)
+    # Counters that already exist keep their value
+    existing = set(conn.execute(select(SystemCounter.name)).scalars())
+    for name, query in COUNTER_QUERIES.items():
+        if name not in existing:
+            conn.execute(SystemCounter.__table__.insert().values(name=name, value=conn.execute(query).scalar()))
+
+def enable_incremental_vacuum(conn):
+    if conn.dialect.name != 'sqlite':
+        return
+    # auto_vacuum only takes effect on an existing database after a full VACUUM
+    conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.exec_driver_sql('VACUUM')
+
+# (version, description, list of SQL statements or callables taking a connection)
+MIGRATIONS = [
+    (1, 'Create base tables', [create_base_tables]),
+    (2, 'Indexes for the queries the bot and dashboard issue', [
+        # get_active_sessions and the active-session count filter on end_time IS NULL
+        'CREATE INDEX IF NOT EXISTS ix_chat_sessions_open ON chat_sessions (start_time) WHERE end_time IS NULL',
+        'CREATE INDEX IF NOT EXISTS ix_messages_session_id ON messages (session_id)',
+        # get_all_chats orders by timestamp
+        'CREATE INDEX IF NOT EXISTS ix_messages_timestamp ON messages (timestamp)',
+        # get_user_messages matches either side of the conversation
+        'CREATE INDEX IF NOT EXISTS ix_messages_from_user ON messages (from_user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_messages_to_user ON messages (to_user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS ix_users_banned ON users (user_id) WHERE is_banned = 1',
+        'CREATE INDEX IF NOT EXISTS ix_admin_logs_admin_action ON admin_logs (admin_username, action)',
+    ]),
+    (3, 'System counters maintained by the write paths', [seed_system_counters]),
+    (4, 'Incremental auto-vacuum so pruned message pages can be reclaimed', [enable_incremental_vacuum]),
+]
+
+def ensure_version_table(conn):
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMP)'
+    ))
+
+def current_version(conn):
+    ensure_version_table(conn)
+    return conn.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+def pending_migrations(engine):
+    with engine.begin() as conn:
+        version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+def migrate(engine):
+    """Apply pending migrations, each in its own transaction, and return their versions"""
+    applied = []
+    for version, description, steps in pending_migrations(engine):
+        with engine.begin() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text('INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)'),
+                {'v': version, 'd': description, 't': datetime.datetime.utcnow()}
+            )
+        print(f"✅ Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+def planned_queries():
+    """The queries the code issues, keyed by where they come from"""
+    return {
+        'Database.get_active_sessions': select(ChatSession).where(ChatSession.end_time.is_(None)),
+        'active session count': select(func.count()).select_from(ChatSession).where(ChatSession.end_time.is_(None)),
+        'Database.get_user_profile': select(User.gender, User.is_banned, User.interests).where(User.user_id == 1),
+        'Database.open_chat_sessions': select(ChatSession.session_id, ChatSession.id).where(ChatSession.end_time.is_(None)),
+        'Database.end_chat_session': select(ChatSession).where(ChatSession.session_id == 'x'),
+        'messages by session': select(Message).where(Message.session_id == 'x'),
+        'Database.get_all_chats': select(Message).order_by(Message.timestamp.desc()).limit(1000),
+        'Database.get_user_messages': select(Message).where(
+            or_(Message.from_user_id == 1, Message.to_user_id == 1)
+        ).order_by(Message.timestamp),
+        'banned user count': select(func.count()).select_from(User).where(User.is_banned == True),
+        'Database.load_banned_users': select(User.user_id).where(User.is_banned == True),
+        'SurveillanceSystem.log_admin_action': select(AdminLog).where(
+            AdminLog.admin_username == 'admin', AdminLog.action == 'x'
+        ),
+    }
+
+def explain(engine):
+    """Return {query name: [plan lines]} from EXPLAIN QUERY PLAN"""
+    plans = {}
+    with engine.connect() as conn:
+        for name, query in planned_queries().items():
+            sql = str(query.compile(engine, compile_kwargs={'literal_binds': True}))
+            rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+def print_query_plans(engine):
+    for name, lines in explain(engine).items():
+        # A bare SCAN of a table (not of an index) means a full table scan
+        full_scan = any(line.startswith('SCAN') and 'INDEX' not in line for line in lines)
+        print(f"{'⚠️ ' if full_scan else '✅'} {name}")
+        for line in lines:
+            print(f"      {line}")
+
+if __name__ == '__main__':
+    from database import create_database_engine
+    from config import Config
+    engine = create_database_engine(Config.DATABASE_URL)
+    migrate(engine)
+    if '--explain' in sys.argv:
+        print_query_plans(engine)
@@ -0,0 +1,174 @@
+import asyncio
+import contextvars
+import logging
+import time
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from config import Config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Classic token bucket, refilled lazily from the monotonic clock"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token, or return how many seconds until one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+class ChatLane:
+    __slots__ = ('bucket', 'lock')
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = asyncio.Lock()  # keeps sends to one chat in order
+
+class OutboundScheduler:
+    """Rate-limited delivery of Bot API calls.
+
+    Every send waits for a token from its chat's bucket and from the global
+    bucket, so we stay under Telegram's per-chat and global flood limits
+    instead of discovering them through 429s. Sends to different chats run
+    concurrently; sends to the same chat keep their order. Flood-wait and
+    transient network errors are retried with backoff, anything else is
+    raised to the caller.
+    """
+    def __init__(self, global_rate=None, global_burst=None, chat_rate=None, chat_burst=None,
+                 max_retries=None, max_lanes=10000):
+        self.global_bucket = TokenBucket(
+            global_rate or Config.SEND_GLOBAL_RATE,
+            global_burst or Config.SEND_GLOBAL_BURST
+        )
+        self.chat_rate = chat_rate or Config.SEND_CHAT_RATE
+        self.chat_burst = chat_burst or Config.SEND_CHAT_BURST
+        self.max_retries = Config.SEND_MAX_RETRIES if max_retries is None else max_retries
+        self.max_lanes = max_lanes
+        self.lanes = {}  # chat_id -> ChatLane
+        self.tasks = set()
+
+        # Metrics
+        self.pending = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _lane(self, chat_id):
+        lane = self.lanes.get(chat_id)
+        if lane is None:
+            if len(self.lanes) >= self.max_lanes:
+                self._prune()
+            lane = self.lanes[chat_id] = ChatLane(self.chat_rate, self.chat_burst)
+        return lane
+
+    def _prune(self):
+        # Idle lanes with a full bucket carry no state worth keeping
+        for chat_id in [chat_id for chat_id, lane in self.lanes.items()
+                        if not lane.lock.locked() and lane.bucket.is_full()]:
+            del self.lanes[chat_id]
+
+    async def _acquire(self, bucket):
+        while True:
+            wait = bucket.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    async def call(self, target_chat, method, *args, **kwargs):
+        """Await one Bot API call aimed at target_chat under the rate limits"""
+        lane = self._lane(target_chat)
+        method_name = getattr(method, '__name__', 'call')
+        self.pending += 1
+        queued_at = time.perf_counter()
+        try:
+            async with lane.lock:
+                for attempt in range(self.max_retries + 1):
+                    await self._acquire(lane.bucket)
+                    await self._acquire(self.global_bucket)
+                    self.in_flight += 1
+                    start = time.perf_counter()
+                    try:
+                        result = await method(*args, **kwargs)
+                        self.sent += 1
+                        return result
+                    except RetryAfter as e:
+                        metrics.BOT_API_ERRORS.inc(method=method_name, error='RetryAfter')
+                        if attempt == self.max_retries:
+                            raise
+                        delay = e.retry_after
+                    except BadRequest:
+                        metrics.BOT_API_ERRORS.inc(method=method_name, error='BadRequest')
+                        raise
+                    except NetworkError as e:
+                        metrics.BOT_API_ERRORS.inc(method=method_name, error=type(e).__name__)
+                        if attempt == self.max_retries:
+                            raise
+                        delay = Config.SEND_RETRY_BACKOFF * 2 ** attempt
+                    finally:
+                        self.in_flight -= 1
+                        metrics.BOT_API_SECONDS.observe(time.perf_counter() - start, method=method_name)
+
+                    self.retried += 1
+                    logger.warning(f"Send to chat {target_chat} failed, retrying in {delay}s")
+                    await asyncio.sleep(delay)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            # Rate-limit waits included, that is what the awaiting update sees
+            metrics.record_span('outbound', time.perf_counter() - queued_at)
+
+    async def send_message(self, bot, chat_id, text, **kwargs):
+        return await self.call(chat_id, bot.send_message, chat_id=chat_id, text=text, **kwargs)
+
+    async def copy_message(self, bot, chat_id, from_chat_id, message_id, **kwargs):
+        return await self.call(
+            chat_id, bot.copy_message, chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id, **kwargs
+        )
+
+    def submit(self, bot, chat_id, text, **kwargs):
+        """Fire-and-forget send_message, failures are logged instead of raised"""
+        # A fresh context keeps these sends out of the submitting update's trace
+        task = asyncio.create_task(self._send_logged(bot, chat_id, text, **kwargs), context=contextvars.Context())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _send_logged(self, bot, chat_id, text, **kwargs):
+        try:
+            await self.send_message(bot, chat_id, text, **kwargs)
+        except Exception as e:
+            logger.error(f"Error sending message to {chat_id}: {e}")
+
+    def stats(self):
+        return {
+            'queue_depth': self.pending - self.in_flight,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed,
+            'chats': len(self.lanes)
+        }
+
+    async def close(self):
+        """Wait for fire-and-forget sends that are still pending"""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
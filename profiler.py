@@ -0,0 +1,136 @@
+"""On-demand sampling profiler for the bot's event loop.
+
+The bot registers the thread that runs its event loop. When that is the
+main thread, as under uvicorn or run_polling, a wall-clock interval timer
+interrupts it every Config.PROFILE_INTERVAL seconds and the signal handler
+records the interrupted stack, so samples land wherever the loop really is.
+Otherwise the stack is read from another thread through
+sys._current_frames(), which under the GIL mostly catches the loop when it
+releases the lock, i.e. in blocking calls. Nothing is left running between
+profiles. Time the loop spends idle shows up under the selector's select().
+start_profile() runs a profile on its own thread, so the caller (a
+dashboard request) returns at once and picks the report up later.
+"""
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+from config import Config
+
+MAX_STACK_DEPTH = 64
+
+loop_thread_id = None  # thread running the bot's event loop, None when the bot isn't in this process
+use_timer = False  # sample with SIGALRM, only possible when the loop runs on the main thread
+profile_lock = threading.Lock()  # one profile at a time
+last_report = None  # report of the last finished profile
+_timer_stacks = None  # Counter the SIGALRM handler records into while a profile runs
+
+def _on_timer(signum, frame):
+    stacks = _timer_stacks
+    if stacks is not None:
+        stacks[_stack(frame)] += 1
+
+def register_loop_thread():
+    """Make the calling thread, the one running the bot's event loop, the one start_profile() samples"""
+    global loop_thread_id, use_timer
+    loop_thread_id = threading.get_ident()
+    # Signal handlers run on the main thread and can only be installed from it
+    use_timer = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if use_timer:
+        signal.signal(signal.SIGALRM, _on_timer)
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}'
+
+def _stack(frame):
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()  # outermost call first
+    return tuple(labels)
+
+def sample_with_timer(seconds, interval):
+    """Counter of the main thread's stacks, recorded by the SIGALRM handler every interval seconds"""
+    global _timer_stacks
+    stacks = collections.Counter()
+    _timer_stacks = stacks
+    signal.setitimer(signal.ITIMER_REAL, interval, interval)
+    try:
+        time.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        _timer_stacks = None
+    return collections.Counter(stacks)
+
+def sample_thread(thread_id, seconds, interval):
+    """Counter of the stacks seen on thread_id, read from this thread every interval seconds"""
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        stacks[_stack(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return stacks
+
+def hot_stack_report(stacks, top):
+    """Aggregate sampled stacks into the hottest functions and the hottest whole stacks"""
+    samples = sum(stacks.values())
+    own = collections.Counter()  # function -> samples where it was running
+    inclusive = collections.Counter()  # function -> samples where it was on the stack
+    for stack, count in stacks.items():
+        functions = [label.rsplit(':', 1)[0] for label in stack]
+        own[functions[-1]] += count
+        for function in set(functions):
+            inclusive[function] += count
+
+    def share(count):
+        return round(count / samples, 4) if samples else 0.0
+
+    return {
+        'samples': samples,
+        'functions': [
+            {'function': function, 'self': share(count), 'total': share(inclusive[function])}
+            for function, count in own.most_common(top)
+        ],
+        'stacks': [{'share': share(count), 'stack': list(stack)} for stack, count in stacks.most_common(top)]
+    }
+
+def start_profile(seconds, interval=None, top=None):
+    """Profile the loop for at most PROFILE_MAX_SECONDS on a background thread into last_report, False if one is running"""
+    if not profile_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        global last_report
+        try:
+            last_report = _run_profile(seconds, interval, top)
+        finally:
+            profile_lock.release()
+
+    threading.Thread(target=run, name='loop-profiler', daemon=True).start()
+    return True
+
+def is_running():
+    return profile_lock.locked()
+
+def _run_profile(seconds, interval, top):
+    seconds = max(0.0, min(seconds, Config.PROFILE_MAX_SECONDS))
+    interval = interval or Config.PROFILE_INTERVAL
+    started = time.monotonic()
+    if use_timer:
+        stacks = sample_with_timer(seconds, interval)
+    else:
+        stacks = sample_thread(loop_thread_id, seconds, interval)
+    report = hot_stack_report(stacks, top or Config.PROFILE_TOP_STACKS)
+    report['seconds'] = round(time.monotonic() - started, 3)
+    report['interval'] = interval
+    report['sampler'] = 'timer' if use_timer else 'thread'
+    report['finished_at'] = time.time()
+    return report
@@ -0,0 +1,36 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+def save_snapshot(path, data):
+    """Write data as compact JSON to a temporary file and swap it in, so a crash mid-write keeps the last snapshot"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': SNAPSHOT_VERSION, **data}, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_snapshot(path, max_age=None):
+    """The snapshot saved at path, or None if there is none, it can't be read or it is older than max_age seconds"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state snapshot {path}: {e}")
+        return None
+    if data.get('version') != SNAPSHOT_VERSION:
+        logger.warning(f"Ignoring state snapshot {path} with version {data.get('version')}")
+        return None
+    age = time.time() - data.get('saved_at', 0)
+    if max_age is not None and age > max_age:
+        logger.warning(f"Ignoring state snapshot {path} saved {age:.0f}s ago")
+        return None
+    return data
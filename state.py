@@ -0,0 +1,597 @@
+import asyncio
+import datetime
+import functools
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from matchmaking import MatchmakingQueue
+from tasks import PeriodicTask
+from config import Config
+
+class StateBackend:
+    """Live matchmaking pool and session registry used by the bot.
+
+    Sessions are returned as dicts with 'session_id', 'partner_id',
+    'start_time', 'message_count' and 'row_id' (the ChatSession primary key,
+    once attach_row() has recorded it) and 'last_active', the wall-clock
+    time of the pair's last message seen by any worker. pair() must be atomic: a waiting
+    user is handed to at most one searcher, even when several bot workers
+    share the backend. Waiters for whom exclude(user_id) is true (e.g.
+    banned since they queued) are dropped from the pool instead of being
+    paired. When recent is a RecentPartners, a searcher's recent partners
+    are passed over as long as someone else can be paired.
+
+    The bot goes through the awaitable aio front (AsyncStateBackend), which
+    keeps blocking backends off the event loop.
+    """
+    exclude = None
+    recent = None
+    durable = False  # True when the state outlives the process by itself, no snapshots needed
+    blocking = False  # True when calls can block on I/O or locks held by other processes
+    _aio = None
+
+    @property
+    def aio(self):
+        if self._aio is None:
+            self._aio = AsyncStateBackend(self)
+        return self._aio
+
+    def enqueue(self, user_id, gender, interests=()):
+        raise NotImplementedError
+
+    def dequeue(self, user_id):
+        raise NotImplementedError
+
+    def is_waiting(self, user_id):
+        raise NotImplementedError
+
+    def pair(self, user_id, gender, session_id):
+        """Claim a partner for user_id and open session_id for both, return the partner id or None.
+
+        A searcher who is still in a session is never paired.
+        """
+        raise NotImplementedError
+
+    def get_session(self, user_id):
+        raise NotImplementedError
+
+    def attach_row(self, user_id, row_id, session_id):
+        """Remember the ChatSession row of user_id's session, so closing it needs no lookup.
+        
+        Returns False if session_id has already been closed, in which case
+        nobody else will end the row.
+        """
+        raise NotImplementedError
+
+    def count_message(self, user_id):
+        """Count one message relayed in user_id's session"""
+        raise NotImplementedError
+
+    def close_session(self, user_id):
+        """End user_id's session for both sides, return its data or None if there was none"""
+        raise NotImplementedError
+
+    def snapshot(self):
+        """JSON-serialisable copy of the pool and the session registry"""
+        raise NotImplementedError
+
+    def restore(self, snapshot, open_rows, max_wait=None):
+        """Load a snapshot() taken before a restart into the empty backend.
+
+        Only sessions whose ChatSession row is still open come back, open_rows
+        maps their session_id to the row id. Waiters who have been waiting
+        longer than max_wait seconds by now, downtime included, are dropped.
+        Returns ([(user_id, bucket, interests, waited)], [(session_id, user_a,
+        user_b, idle)]) for what was restored, waited and idle in seconds.
+        """
+        raise NotImplementedError
+
+    def waiting_sizes(self):
+        raise NotImplementedError
+
+    def active_session_count(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class AsyncStateBackend:
+    """Awaitable front of a StateBackend, used from the bot's event loop.
+
+    Calls to a blocking backend run one at a time on a dedicated thread, so
+    waiting on another worker's SQLite write lock stalls that thread instead
+    of every update on the loop. In-memory backends are called inline.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state') if backend.blocking else None
+
+    async def run(self, func, *args):
+        if self.executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def enqueue(self, user_id, gender, interests=()):
+        return await self.run(self.backend.enqueue, user_id, gender, interests)
+
+    async def dequeue(self, user_id):
+        return await self.run(self.backend.dequeue, user_id)
+
+    async def is_waiting(self, user_id):
+        return await self.run(self.backend.is_waiting, user_id)
+
+    async def pair(self, user_id, gender, session_id):
+        return await self.run(self.backend.pair, user_id, gender, session_id)
+
+    async def get_session(self, user_id):
+        return await self.run(self.backend.get_session, user_id)
+
+    async def attach_row(self, user_id, row_id, session_id):
+        return await self.run(self.backend.attach_row, user_id, row_id, session_id)
+
+    async def count_message(self, user_id):
+        # In memory for every backend, not worth a thread hop
+        return self.backend.count_message(user_id)
+
+    async def close_session(self, user_id):
+        return await self.run(self.backend.close_session, user_id)
+
+    async def close(self):
+        await self.run(self.backend.close)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+class ChatPair:
+    """One active chat, shared by both participants' registry entries"""
+    __slots__ = ('user_a', 'user_b', 'session_id', 'start_time', 'message_count', 'row_id', 'last_active')
+
+    def __init__(self, user_a, user_b, session_id, start_time):
+        self.user_a = user_a
+        self.user_b = user_b
+        self.session_id = session_id
+        self.start_time = start_time
+        self.message_count = 0
+        self.row_id = None
+        self.last_active = time.time()
+
+    def partner_of(self, user_id):
+        return self.user_b if user_id == self.user_a else self.user_a
+
+    def as_dict(self, user_id):
+        return {
+            'session_id': self.session_id,
+            'partner_id': self.partner_of(user_id),
+            'start_time': self.start_time,
+            'message_count': self.message_count,
+            'row_id': self.row_id,
+            'last_active': self.last_active
+        }
+
+class MemoryStateBackend(StateBackend):
+    """Single-process backend, state lives in this worker's memory"""
+    def __init__(self):
+        self.waiting_users = MatchmakingQueue()
+        self.active_sessions = {}  # user_id -> ChatPair, both participants share one
+
+    def enqueue(self, user_id, gender, interests=()):
+        self.waiting_users.add(user_id, gender, interests)
+
+    def dequeue(self, user_id):
+        self.waiting_users.remove(user_id)
+
+    def is_waiting(self, user_id):
+        return user_id in self.waiting_users
+
+    def pair(self, user_id, gender, session_id):
+        if user_id in self.active_sessions:
+            return None
+        partner_id = self.waiting_users.pop_partner(
+            user_id, gender,
+            is_available=lambda candidate: (
+                candidate not in self.active_sessions and not (self.exclude and self.exclude(candidate))
+            ),
+            avoid=(lambda candidate: self.recent.avoids(user_id, candidate)) if self.recent else None
+        )
+        if partner_id is None:
+            return None
+
+        chat = ChatPair(user_id, partner_id, session_id, datetime.datetime.utcnow())
+        self.active_sessions[user_id] = chat
+        self.active_sessions[partner_id] = chat
+        return partner_id
+
+    def get_session(self, user_id):
+        chat = self.active_sessions.get(user_id)
+        return chat.as_dict(user_id) if chat else None
+
+    def attach_row(self, user_id, row_id, session_id):
+        chat = self.active_sessions.get(user_id)
+        if chat is None or chat.session_id != session_id:
+            return False
+        chat.row_id = row_id
+        return True
+
+    def count_message(self, user_id):
+        chat = self.active_sessions.get(user_id)
+        if chat:
+            chat.message_count += 1
+            chat.last_active = time.time()
+
+    def close_session(self, user_id):
+        chat = self.active_sessions.pop(user_id, None)
+        if chat is None:
+            return None
+        self.active_sessions.pop(chat.partner_of(user_id), None)
+        return chat.as_dict(user_id)
+
+    def snapshot(self):
+        # Lists rather than dicts keep the file small, each chat is written once
+        return {
+            'saved_at': time.time(),
+            'waiting': [list(entry) for entry in self.waiting_users.dump()],
+            'sessions': [
+                [
+                    chat.user_a, chat.user_b, chat.session_id, chat.start_time.isoformat(),
+                    chat.message_count, chat.row_id, chat.last_active
+                ]
+                for user_id, chat in self.active_sessions.items() if user_id == chat.user_a
+            ]
+        }
+
+    def restore(self, snapshot, open_rows, max_wait=None):
+        now = time.time()
+        sessions = []
+        for user_a, user_b, session_id, start_time, message_count, _, *rest in snapshot['sessions']:
+            row_id = open_rows.get(session_id)
+            if row_id is None or user_a in self.active_sessions or user_b in self.active_sessions:
+                continue
+            chat = ChatPair(user_a, user_b, session_id, datetime.datetime.fromisoformat(start_time))
+            chat.message_count = message_count
+            chat.row_id = row_id
+            # Snapshots from before last_active was saved count from the save
+            chat.last_active = min(rest[0] if rest else snapshot['saved_at'], now)
+            self.active_sessions[user_a] = chat
+            self.active_sessions[user_b] = chat
+            sessions.append((session_id, user_a, user_b, now - chat.last_active))
+
+        downtime = max(0.0, now - snapshot['saved_at'])
+        waiters = []
+        for user_id, bucket, interests, waited in snapshot['waiting']:
+            waited += downtime
+            if user_id in self.active_sessions or (max_wait is not None and waited >= max_wait):
+                continue
+            self.waiting_users.add(user_id, bucket, interests, waited)
+            waiters.append((user_id, bucket, interests, waited))
+        return waiters, sessions
+
+    def waiting_sizes(self):
+        return self.waiting_users.sizes()
+
+    def active_session_count(self):
+        return len(self.active_sessions) // 2
+
+class SQLiteStateBackend(StateBackend):
+    """Backend shared by every bot worker on the host through one SQLite file.
+
+    Pairing runs inside a BEGIN IMMEDIATE transaction, which takes SQLite's
+    write lock up front, so two workers can never claim the same waiting
+    user. Every operation is a single short transaction. Matching follows
+    the same rules as MatchmakingQueue, with waiting_interests as the
+    inverted index from (bucket, tag) to waiters. The file survives restarts
+    on its own, so this backend is never snapshotted.
+    """
+    durable = True
+    blocking = True
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS waiting (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            bucket TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS waiting_interests (
+            bucket TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (bucket, tag, seq)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            partner_id INTEGER NOT NULL,
+            session_id TEXT NOT NULL,
+            start_time TEXT NOT NULL
+        );
+    """
+    # Added after the first release, state files created before then get them on open
+    ADDED_COLUMNS = {
+        'waiting': {
+            'has_interests': 'INTEGER NOT NULL DEFAULT 0',
+            'enqueued_at': 'REAL NOT NULL DEFAULT 0'
+        },
+        'sessions': {
+            'message_count': 'INTEGER NOT NULL DEFAULT 0',  # messages sent by this row's user
+            'row_id': 'INTEGER',
+            'last_active': 'REAL NOT NULL DEFAULT 0'  # when this row's user last sent a message, or the pairing
+        }
+    }
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS ix_waiting_bucket_seq ON waiting (bucket, seq);
+        CREATE INDEX IF NOT EXISTS ix_waiting_plain ON waiting (bucket, seq) WHERE has_interests = 0;
+        CREATE INDEX IF NOT EXISTS ix_waiting_interests_user ON waiting_interests (user_id);
+    """
+
+    def __init__(self, path=None, busy_timeout=2.0, interest_wait=None, scan_limit=None, clock=time.time):
+        self.path = path or Config.STATE_DB_PATH
+        self.interest_wait = Config.INTEREST_MATCH_WAIT if interest_wait is None else interest_wait
+        self.scan_limit = scan_limit or Config.INTEREST_SCAN_LIMIT
+        # Wall-clock time, since every worker compares the same enqueued_at values
+        self.clock = clock
+        # isolation_level=None lets us issue BEGIN IMMEDIATE ourselves
+        self.conn = sqlite3.connect(self.path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        for table, added in self.ADDED_COLUMNS.items():
+            columns = {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}
+            for name, definition in added.items():
+                if name not in columns:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+        self.conn.executescript(self.INDEXES)
+        self.lock = threading.Lock()
+        # Relayed messages are counted in memory and added to the rows in batches
+        self.pending_counts = {}  # user_id -> messages not yet written to their row
+        self.pending_activity = {}  # user_id -> time of their last message not yet written
+        self.count_lock = threading.Lock()
+        self.count_flusher = PeriodicTask(Config.STATE_FLUSH_INTERVAL, self.flush_counts, 'state-count-flush')
+
+    def _transaction(self, func, *args):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(*args)
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    def _interests_of(self, user_id):
+        return sorted(row[0] for row in self.conn.execute('SELECT tag FROM waiting_interests WHERE user_id = ?', (user_id,)))
+
+    def _remove_waiters(self, *user_ids):
+        placeholders = ', '.join('?' * len(user_ids))
+        self.conn.execute(f'DELETE FROM waiting WHERE user_id IN ({placeholders})', user_ids)
+        self.conn.execute(f'DELETE FROM waiting_interests WHERE user_id IN ({placeholders})', user_ids)
+
+    def enqueue(self, user_id, gender, interests=()):
+        bucket = MatchmakingQueue.bucket_for(gender)
+        interests = sorted(set(interests))
+
+        def do_enqueue():
+            row = self.conn.execute('SELECT bucket FROM waiting WHERE user_id = ?', (user_id,)).fetchone()
+            if row and row[0] == bucket and self._interests_of(user_id) == interests:
+                return
+            self._remove_waiters(user_id)
+            seq = self.conn.execute(
+                'INSERT INTO waiting (user_id, bucket, has_interests, enqueued_at) VALUES (?, ?, ?, ?)',
+                (user_id, bucket, int(bool(interests)), self.clock())
+            ).lastrowid
+            self.conn.executemany(
+                'INSERT INTO waiting_interests (bucket, tag, seq, user_id) VALUES (?, ?, ?, ?)',
+                [(bucket, tag, seq, user_id) for tag in interests]
+            )
+
+        self._transaction(do_enqueue)
+
+    def dequeue(self, user_id):
+        self._transaction(self._remove_waiters, user_id)
+
+    def is_waiting(self, user_id):
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM waiting WHERE user_id = ?', (user_id,)).fetchone() is not None
+
+    @staticmethod
+    def _skip_users(user_ids):
+        return f" AND user_id NOT IN ({', '.join('?' * len(user_ids))})" if user_ids else ''
+
+    def _best_interest_match(self, user_id, candidate_buckets, interests, recent=()):
+        # The oldest scan_limit waiters per (bucket, tag), scored by how many tags they share
+        scans = []
+        params = []
+        for candidate_bucket in candidate_buckets:
+            for tag in interests:
+                scans.append(
+                    'SELECT * FROM (SELECT user_id, seq FROM waiting_interests AS wi '
+                    'WHERE bucket = ? AND tag = ? AND user_id != ? '
+                    'AND NOT EXISTS (SELECT 1 FROM sessions WHERE sessions.user_id = wi.user_id)'
+                    f'{self._skip_users(recent)} ORDER BY seq LIMIT ?)'
+                )
+                params.extend((candidate_bucket, tag, user_id, *recent, self.scan_limit))
+        row = self.conn.execute(
+            f"SELECT user_id FROM ({' UNION ALL '.join(scans)}) GROUP BY user_id ORDER BY COUNT(*) DESC, MIN(seq) LIMIT 1",
+            params
+        ).fetchone()
+        return row[0] if row else None
+
+    def pair(self, user_id, gender, session_id):
+        candidate_buckets = MatchmakingQueue.CANDIDATES[MatchmakingQueue.bucket_for(gender)]
+
+        def do_pair():
+            if self.conn.execute('SELECT 1 FROM sessions WHERE user_id = ?', (user_id,)).fetchone():
+                return None
+            while True:
+                partner_id = self._choose_partner(user_id, candidate_buckets)
+                if partner_id is None:
+                    return None
+                if not (self.exclude and self.exclude(partner_id)):
+                    break
+                self._remove_waiters(partner_id)
+
+            start_time = datetime.datetime.utcnow().isoformat()
+            now = self.clock()
+            self._remove_waiters(user_id, partner_id)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO sessions (user_id, partner_id, session_id, start_time, last_active) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(user_id, partner_id, session_id, start_time, now), (partner_id, user_id, session_id, start_time, now)]
+            )
+            return partner_id
+
+        return self._transaction(do_pair)
+
+    def _choose_partner(self, user_id, candidate_buckets):
+        own = self.conn.execute('SELECT enqueued_at FROM waiting WHERE user_id = ?', (user_id,)).fetchone()
+        enqueued_at = own[0] if own else self.clock()
+        interests = self._interests_of(user_id)
+        cutoff = self.clock() - self.interest_wait
+        # Only the searcher's own history is needed, pairs are recorded on both sides
+        recent = self.recent.partners_of(user_id) if self.recent else ()
+
+        def oldest_waiter(candidate_bucket, skipped):
+            # Walks ix_waiting_bucket_seq in FIFO order, skipping waiters already in a chat
+            return self.conn.execute(
+                'SELECT user_id, enqueued_at FROM waiting WHERE bucket = ? AND user_id != ? '
+                'AND NOT EXISTS (SELECT 1 FROM sessions WHERE sessions.user_id = waiting.user_id)'
+                f'{self._skip_users(skipped)} ORDER BY seq LIMIT 1',
+                (candidate_bucket, user_id, *skipped)
+            ).fetchone()
+
+        partner_id = None
+        if interests:
+            partner_id = self._best_interest_match(user_id, candidate_buckets, interests, recent)
+        if partner_id is None:
+            for candidate_bucket in candidate_buckets:
+                row = oldest_waiter(candidate_bucket, recent)
+                if row and (enqueued_at <= cutoff or row[1] <= cutoff):
+                    partner_id = row[0]
+                elif not interests:
+                    row = self.conn.execute(
+                        'SELECT user_id FROM waiting WHERE bucket = ? AND has_interests = 0 AND user_id != ? '
+                        'AND NOT EXISTS (SELECT 1 FROM sessions WHERE sessions.user_id = waiting.user_id)'
+                        f'{self._skip_users(recent)} ORDER BY seq LIMIT 1',
+                        (candidate_bucket, user_id, *recent)
+                    ).fetchone()
+                    partner_id = row[0] if row else None
+                if partner_id is not None:
+                    break
+        if partner_id is None and recent:
+            # Too few waiters to avoid recent partners, pair again after the same wait
+            for candidate_bucket in candidate_buckets:
+                row = oldest_waiter(candidate_bucket, ())
+                if row and (enqueued_at <= cutoff or row[1] <= cutoff):
+                    partner_id = row[0]
+                    break
+        return partner_id
+
+    # Each side's row counts the messages that user sent, a session's total is the sum of both rows
+    SESSION_QUERY = (
+        'SELECT mine.partner_id, mine.session_id, mine.start_time, mine.row_id, '
+        'mine.message_count + COALESCE(theirs.message_count, 0), '
+        'MAX(mine.last_active, COALESCE(theirs.last_active, 0)) '
+        'FROM sessions AS mine LEFT JOIN sessions AS theirs ON theirs.user_id = mine.partner_id '
+        'WHERE mine.user_id = ?'
+    )
+
+    def _session_from_row(self, user_id, row, pending=None):
+        if not row:
+            return None
+        with self.count_lock:
+            if pending is None:
+                pending = self.pending_counts.get(user_id, 0) + self.pending_counts.get(row[0], 0)
+            last_active = max(row[5], self.pending_activity.get(user_id, 0), self.pending_activity.get(row[0], 0))
+        return {
+            'session_id': row[1],
+            'partner_id': row[0],
+            'start_time': datetime.datetime.fromisoformat(row[2]),
+            'row_id': row[3],
+            'message_count': row[4] + pending,
+            'last_active': last_active
+        }
+
+    def get_session(self, user_id):
+        with self.lock:
+            row = self.conn.execute(self.SESSION_QUERY, (user_id,)).fetchone()
+        return self._session_from_row(user_id, row)
+
+    def attach_row(self, user_id, row_id, session_id):
+        with self.lock:
+            return self.conn.execute(
+                'UPDATE sessions SET row_id = ? '
+                'WHERE user_id IN (?, (SELECT partner_id FROM sessions WHERE user_id = ?)) AND session_id = ?',
+                (row_id, user_id, user_id, session_id)
+            ).rowcount > 0
+
+    def count_message(self, user_id):
+        # No I/O per message, flush_counts() writes the totals every STATE_FLUSH_INTERVAL seconds
+        with self.count_lock:
+            self.pending_counts[user_id] = self.pending_counts.get(user_id, 0) + 1
+            self.pending_activity[user_id] = self.clock()
+        if self.count_flusher.thread is None:
+            self.count_flusher.start()
+
+    def flush_counts(self):
+        """Add the counts and activity gathered in memory to each sender's row in one transaction"""
+        with self.count_lock:
+            pending, self.pending_counts = self.pending_counts, {}
+            activity, self.pending_activity = self.pending_activity, {}
+        if not pending:
+            return 0
+        try:
+            self._transaction(
+                self.conn.executemany,
+                'UPDATE sessions SET message_count = message_count + ?, last_active = MAX(last_active, ?) '
+                'WHERE user_id = ?',
+                [(count, activity[user_id], user_id) for user_id, count in pending.items()]
+            )
+        except Exception:
+            # Keep them for the next flush
+            with self.count_lock:
+                for user_id, count in pending.items():
+                    self.pending_counts[user_id] = self.pending_counts.get(user_id, 0) + count
+                    self.pending_activity[user_id] = max(self.pending_activity.get(user_id, 0), activity[user_id])
+            raise
+        return sum(pending.values())
+
+    def close_session(self, user_id):
+        def do_close():
+            row = self.conn.execute(self.SESSION_QUERY, (user_id,)).fetchone()
+            if not row:
+                return None
+            self.conn.execute('DELETE FROM sessions WHERE user_id IN (?, ?)', (user_id, row[0]))
+            # This worker's unwritten counts for the pair go into the returned total
+            with self.count_lock:
+                pending = self.pending_counts.pop(user_id, 0) + self.pending_counts.pop(row[0], 0)
+                self.pending_activity.pop(user_id, None)
+                self.pending_activity.pop(row[0], None)
+            return self._session_from_row(user_id, row, pending)
+
+        return self._transaction(do_close)
+
+    def waiting_sizes(self):
+        sizes = {bucket: 0 for bucket in MatchmakingQueue.BUCKETS}
+        with self.lock:
+            for bucket, count in self.conn.execute('SELECT bucket, COUNT(*) FROM waiting GROUP BY bucket'):
+                sizes[bucket] = count
+        return sizes
+
+    def active_session_count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] // 2
+
+    def close(self):
+        self.count_flusher.stop()
+        self.flush_counts()
+        with self.lock:
+            self.conn.close()
+
+STATE_BACKENDS = {
+    'memory': MemoryStateBackend,
+    'sqlite': SQLiteStateBackend
+}
+
+def create_state_backend(name=None):
+    name = name or Config.STATE_BACKEND
+    if name not in STATE_BACKENDS:
+        raise ValueError(f"Unknown state backend: {name}")
+    return STATE_BACKENDS[name]()
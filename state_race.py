@@ -0,0 +1,89 @@
+"""Multi-process pairing race check for the SQLite state backend.
+
+Several worker processes share one throwaway state file, the way uvicorn
+workers share STATE_DB_PATH, and pair searchers against a common pool of
+waiters at the same time:
+
+    python state_race.py
+    python state_race.py --workers 8 --waiters 2000 --searchers 500
+
+Exits non-zero if any user ended up in two chats or the sessions table
+disagrees with the pairings the workers reported.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from state import SQLiteStateBackend
+
+def search(path, worker, searchers, results):
+    """Enqueue and pair this worker's searchers, report the (searcher, partner) pairs it made"""
+    state = SQLiteStateBackend(path, busy_timeout=30.0)
+    pairs = []
+    try:
+        for n in range(searchers):
+            user_id = (worker + 1) * 1_000_000 + n
+            state.enqueue(user_id, 'female')
+            partner_id = state.pair(user_id, 'female', f'race-{user_id}')
+            if partner_id is not None:
+                pairs.append((user_id, partner_id))
+    finally:
+        state.close()
+        results.put(pairs)
+
+def check(state, pairs):
+    """Problems with the pairings, empty when every user is in at most one symmetric chat"""
+    problems = []
+    seen = {}
+    for user_id, partner_id in pairs:
+        for member in (user_id, partner_id):
+            if member in seen:
+                problems.append(f'user {member} paired twice: {seen[member]} and {(user_id, partner_id)}')
+            seen[member] = (user_id, partner_id)
+
+    sessions = dict(state.conn.execute('SELECT user_id, partner_id FROM sessions'))
+    for user_id, partner_id in pairs:
+        if sessions.get(user_id) != partner_id or sessions.get(partner_id) != user_id:
+            problems.append(f'sessions table disagrees for pair {(user_id, partner_id)}')
+    if len(sessions) != 2 * len(pairs):
+        problems.append(f'{len(sessions)} session rows for {len(pairs)} pairs')
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--waiters', type=int, default=1000)
+    parser.add_argument('--searchers', type=int, default=300, help='searchers per worker')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'state_race.db')
+    state = SQLiteStateBackend(path)
+    for user_id in range(args.waiters):
+        state.enqueue(user_id, 'male')
+
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=search, args=(path, worker, args.searchers, results))
+        for worker in range(args.workers)
+    ]
+    for process in workers:
+        process.start()
+    # Drain before joining, a worker blocks on exit until its results are read
+    pairs = [pair for _ in workers for pair in results.get()]
+    for process in workers:
+        process.join()
+
+    problems = check(state, pairs)
+    if any(process.exitcode for process in workers):
+        problems.append('a worker process failed')
+    print(f'{args.workers} workers made {len(pairs)} pairings, '
+          f'{state.active_session_count()} active sessions, waiting {state.waiting_sizes()}')
+    state.close()
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,14 @@
 import datetime
-from database import Database
-from config import Config
+from database import get_database, User, Message, AdminLog
 
 class SurveillanceSystem:
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, db=None):
+        self._db = db
+    
+    @property
+    def db(self):
+        # Resolved on first use so importing the dashboard doesn't open the database
+        return self._db or get_database()
     
     def log_admin_action(self, admin_username, action):
         admin_log = self.db.session.query(AdminLog).filter_by(
@@ -18,16 +22,14 @@ class SurveillanceSystem:
             self.db.session.commit()
     
     def get_system_stats(self):
-        total_users = self.db.session.query(User).count()
-        total_messages = self.db.session.query(Message).count()
-        active_sessions = self.db.session.query(ChatSession).filter_by(end_time=None).count()
-        banned_users = self.db.session.query(User).filter_by(is_banned=True).count()
+        # Counters are maintained by the write paths, so this is one small read
+        counters = self.db.get_counters()
         
         return {
-            'total_users': total_users,
-            'total_messages': total_messages,
-            'active_sessions': active_sessions,
-            'banned_users': banned_users,
+            'total_users': counters['total_users'],
+            'total_messages': counters['total_messages'],
+            'active_sessions': counters['active_sessions'],
+            'banned_users': counters['banned_users'],
             'timestamp': datetime.datetime.utcnow()
         }
     
@@ -0,0 +1,37 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PeriodicTask:
+    """Run func every interval seconds on a daemon thread until stopped"""
+    def __init__(self, interval, func, name):
+        self.interval = interval
+        self.func = func
+        self.name = name
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None and not self.stopped.is_set()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception as e:
+                logger.error(f"Error in background task {self.name}: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()